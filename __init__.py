@@ -1,4 +1,8 @@
 from .faceless.nodes.globals import NODE_CLASS_MAPPINGS, NODE_DISPLAY_NAME_MAPPINGS
+from .faceless.preload import register_preload_route, start_preload
+
+register_preload_route()
+start_preload()
 
 WEB_DIRECTORY = "./web"
 __all__ = ["NODE_CLASS_MAPPINGS", "NODE_DISPLAY_NAME_MAPPINGS", "WEB_DIRECTORY"]
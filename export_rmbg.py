@@ -0,0 +1,43 @@
+import os
+import sys
+import glob
+import argparse
+
+import numpy as np
+from PIL import Image
+
+parser = argparse.ArgumentParser(description="Export the background removal model to onnx and compare it with torch")
+
+parser.add_argument(
+    "--quantize",
+    action="store_true",
+    help="Also build the int8 variant of the exported model",
+    default=False,
+)
+parser.add_argument(
+    "--skip-check",
+    action="store_true",
+    help="Only export the model, skip the parity check",
+    default=False,
+)
+
+args = parser.parse_args()
+
+base_path = os.path.dirname(os.path.realpath(__file__))
+# The ComfyUI root provides folder_paths, the models dir is resolved from it
+sys.path.insert(0, os.path.normpath(os.path.join(base_path, "../..")))
+sys.path.insert(0, base_path)
+
+from faceless.processors.background_removal import export_rmbg_model, check_rmbg_parity
+
+print(f"Exported `rmbg` to {export_rmbg_model()}")
+backends = ["onnx"]
+if args.quantize:
+    print(f"Quantized `rmbg` to {export_rmbg_model(quantize=True)}")
+    backends.append("onnx_int8")
+
+if not args.skip_check:
+    sample_frames = [np.array(Image.open(image_path).convert("RGB")) for image_path in sorted(glob.glob(os.path.join(base_path, "examples/images/*")))]
+    for backend in backends:
+        metrics = check_rmbg_parity(sample_frames, backend)
+        print(f"Checked `{backend}` against torch: " + ", ".join(f"{key}={value:.4f}" for key, value in metrics.items()))
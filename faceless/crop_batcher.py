@@ -0,0 +1,91 @@
+from typing import Callable, Dict, List, Optional
+import threading
+
+from .typing import VisionFrame
+
+
+class CropBatchRequest:
+
+    def __init__(self, crop_vision_frames : List[VisionFrame]) -> None:
+        self.crop_vision_frames = crop_vision_frames
+        self.enhanced_vision_frames : Optional[List[VisionFrame]] = None
+        self.error : Optional[BaseException] = None
+        self.done_event = threading.Event()
+
+
+class CropBatcher:
+
+    def __init__(self, enhance : Callable[[str, List[VisionFrame]], List[VisionFrame]], max_batch_size : int = 8) -> None:
+        self._enhance = enhance
+        self._max_batch_size = max(max_batch_size, 1)
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._requests : Dict[str, List[CropBatchRequest]] = {}
+        self._run_count = 0
+        self._crop_count = 0
+
+    def enhance(self, model_name : str, crop_vision_frames : List[VisionFrame]) -> List[VisionFrame]:
+        # Threads queue their crops, whoever gets to run next takes the crops of every frame waiting behind the running session
+        request = CropBatchRequest(crop_vision_frames)
+        with self._lock:
+            self._requests.setdefault(model_name, []).append(request)
+
+        while not request.done_event.is_set():
+            with self._run_lock:
+                if request.done_event.is_set():
+                    break
+                self._run_batch(model_name, self._take_requests(model_name))
+        if request.error is not None:
+            raise request.error
+        return request.enhanced_vision_frames
+
+    def get_batch_size(self) -> float:
+        with self._lock:
+            return self._crop_count / self._run_count if self._run_count else 0.0
+
+    def get_counts(self) -> Dict[str, int]:
+        with self._lock:
+            return { 'crop_batch_run_count': self._run_count, 'crop_batch_crop_count': self._crop_count }
+
+    def add_counts(self, counts : Dict[str, int]) -> None:
+        with self._lock:
+            self._run_count += counts.get('crop_batch_run_count', 0)
+            self._crop_count += counts.get('crop_batch_crop_count', 0)
+
+    def report(self) -> None:
+        print(f"crop batches: {self._crop_count} crops in {self._run_count} runs ({self.get_batch_size():.1f} per run)")
+
+    def _take_requests(self, model_name : str) -> List[CropBatchRequest]:
+        with self._lock:
+            requests = self._requests.get(model_name, [])
+            take_count = 1
+            crop_count = len(requests[0].crop_vision_frames) if requests else 0
+            while take_count < len(requests) and crop_count + len(requests[take_count].crop_vision_frames) <= self._max_batch_size:
+                crop_count += len(requests[take_count].crop_vision_frames)
+                take_count += 1
+            self._requests[model_name] = requests[take_count:]
+            return requests[:take_count]
+
+    def _run_batch(self, model_name : str, requests : List[CropBatchRequest]) -> None:
+        if not requests:
+            return
+        crop_vision_frames = [ crop_vision_frame for request in requests for crop_vision_frame in request.crop_vision_frames ]
+        try:
+            enhanced_vision_frames = self._enhance(model_name, crop_vision_frames)
+        except Exception as exception:
+            # Run the frames of a failed batch one by one, so a single bad crop does not fail the others
+            if len(requests) > 1:
+                for request in requests:
+                    self._run_batch(model_name, [ request ])
+                return
+            requests[0].error = exception
+            requests[0].done_event.set()
+            return
+        with self._lock:
+            self._run_count += 1
+            self._crop_count += len(crop_vision_frames)
+        index = 0
+        for request in requests:
+            request.enhanced_vision_frames = enhanced_vision_frames[index:index + len(request.crop_vision_frames)]
+            index += len(request.crop_vision_frames)
+            request.done_event.set()
@@ -0,0 +1,86 @@
+from typing import Any, Dict, List, Optional
+import threading
+
+import numpy
+
+from .typing import BoundingBox, VisionFrame
+
+
+class CropCache:
+
+    def __init__(self, diff_threshold : float, max_reuse_count : int = 4, max_track_count : int = 16) -> None:
+        self._diff_threshold = diff_threshold
+        self._max_reuse_count = max_reuse_count
+        self._max_track_count = max_track_count
+        self._lock = threading.Lock()
+        self._tracks : List[Dict[str, Any]] = []
+        self._hit_count = 0
+        self._lookup_count = 0
+
+    def lookup(self, model_name : str, bounding_box : BoundingBox, crop_vision_frame : VisionFrame) -> Optional[VisionFrame]:
+        with self._lock:
+            self._lookup_count += 1
+            track = self._find_track(model_name, bounding_box)
+            if track is None or track['reuse_count'] >= self._max_reuse_count:
+                return None
+            # Compare with the crop that was enhanced, not the last reused one, so slow drift still triggers a refresh
+            if calc_crop_difference(track['crop_vision_frame'], crop_vision_frame) > self._diff_threshold:
+                return None
+            track['bounding_box'] = bounding_box
+            track['reuse_count'] += 1
+            self._hit_count += 1
+            return track['enhanced_vision_frame']
+
+    def store(self, model_name : str, bounding_box : BoundingBox, crop_vision_frame : VisionFrame, enhanced_vision_frame : VisionFrame) -> None:
+        with self._lock:
+            track = self._find_track(model_name, bounding_box)
+            if track is None:
+                track = { 'model_name': model_name }
+                self._tracks.append(track)
+                if len(self._tracks) > self._max_track_count:
+                    self._tracks.pop(0)
+            track['bounding_box'] = bounding_box
+            track['crop_vision_frame'] = crop_vision_frame
+            track['enhanced_vision_frame'] = enhanced_vision_frame
+            track['reuse_count'] = 0
+
+    def get_hit_rate(self) -> float:
+        with self._lock:
+            return self._hit_count / self._lookup_count if self._lookup_count else 0.0
+
+    def get_counts(self) -> Dict[str, int]:
+        with self._lock:
+            return { 'crop_cache_hit_count': self._hit_count, 'crop_cache_lookup_count': self._lookup_count }
+
+    def add_counts(self, counts : Dict[str, int]) -> None:
+        # Lookups of process workers happen in their own caches, their totals are added before the report
+        with self._lock:
+            self._hit_count += counts.get('crop_cache_hit_count', 0)
+            self._lookup_count += counts.get('crop_cache_lookup_count', 0)
+
+    def report(self) -> None:
+        print(f"crop cache: {self._hit_count}/{self._lookup_count} crops reused ({self.get_hit_rate() * 100:.1f}%)")
+
+    def _find_track(self, model_name : str, bounding_box : BoundingBox) -> Optional[Dict[str, Any]]:
+        # Frames run on several threads, the track is the nearest box of the same model seen last, not a strict predecessor
+        face_size = numpy.subtract(bounding_box[2:], bounding_box[:2]).max()
+        face_center = numpy.add(bounding_box[2:], bounding_box[:2]) / 2
+        nearest_track = None
+        nearest_distance = face_size * 0.25
+
+        for track in self._tracks:
+            if track['model_name'] != model_name:
+                continue
+            track_center = numpy.add(track['bounding_box'][2:], track['bounding_box'][:2]) / 2
+            distance = numpy.linalg.norm(face_center - track_center)
+            if distance <= nearest_distance:
+                nearest_track = track
+                nearest_distance = distance
+        return nearest_track
+
+
+def calc_crop_difference(crop_vision_frame : VisionFrame, other_crop_vision_frame : VisionFrame) -> float:
+    if crop_vision_frame.shape != other_crop_vision_frame.shape:
+        return float('inf')
+    # Every fourth pixel is enough to tell a static face from a moving one
+    return float(numpy.mean(numpy.abs(crop_vision_frame[::4, ::4].astype(numpy.int16) - other_crop_vision_frame[::4, ::4])))
@@ -1,11 +1,118 @@
-import torch
+import onnxruntime
 
 from functools import lru_cache
+import hashlib
+import os
+import platform
 import subprocess
 import xml.etree.ElementTree as ElementTree
-from typing import List, Any
+from typing import List, Any, Optional
 
 from .typing import ValueAndUnit, ExecutionDevice
+from .model_cache import get_model_name, get_model_cache_path, is_cached_model
+from .quantization import quantize_model
+
+# Overridden inside worker processes, None keeps the onnxruntime defaults
+execution_providers : Optional[List[str]] = None
+execution_intra_op_thread_count : Optional[int] = None
+# Python threads expected to run sessions at the same time, the host cores are shared between them
+execution_concurrency : int = 4
+# Comma separated model names to run as int8 on CPU, for example "2dfan4,arcface_w600k_r50" or "*"
+execution_quantized_models : List[str] = [ model_name.strip() for model_name in os.environ.get('FACELESS_QUANTIZED_MODELS', '').split(',') if model_name.strip() ]
+# Instruction set extensions the cpu kernels and layout transforms of onnxruntime are picked by
+CPU_ISA_FLAGS = { 'sse4_1', 'sse4_2', 'avx', 'avx2', 'fma', 'f16c', 'avx512f', 'avx512bw', 'avx512vl', 'avx512_vnni', 'avx512_bf16', 'avx_vnni', 'amx_tile', 'amx_int8', 'amx_bf16', 'asimd', 'asimdhp', 'asimddp', 'i8mm', 'bf16', 'sve', 'sve2' }
+
+def create_inference_session(model_path : str) -> onnxruntime.InferenceSession:
+    model_path = resolve_model_path(model_path)
+    providers = apply_execution_provider_options()
+
+    if not can_cache_optimized_model():
+        return onnxruntime.InferenceSession(model_path, sess_options = create_session_options(get_graph_optimization_level()), providers = providers)
+    optimized_model_path = get_model_cache_path(model_path, 'optimized.' + get_providers_tag())
+
+    if os.path.isfile(optimized_model_path):
+        try:
+            # The cached graph is already optimized, skip running the optimizers again
+            return onnxruntime.InferenceSession(optimized_model_path, sess_options = create_session_options(onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL), providers = providers)
+        except Exception as exception:
+            print(f"cannot load optimized model {optimized_model_path}, rebuild it: {exception}")
+            os.remove(optimized_model_path)
+
+    session_options = create_session_options(get_graph_optimization_level())
+    temp_optimized_model_path = optimized_model_path + '.' + str(os.getpid()) + '.tmp'
+    try:
+        os.makedirs(os.path.dirname(optimized_model_path), exist_ok = True)
+        session_options.optimized_model_filepath = temp_optimized_model_path
+        session = onnxruntime.InferenceSession(model_path, sess_options = session_options, providers = providers)
+    except Exception as exception:
+        # Serializing fails for graphs with compiled nodes, the session itself does not depend on the cache
+        print(f"cannot cache optimized model for {get_model_name(model_path)}: {exception}")
+        if os.path.isfile(temp_optimized_model_path):
+            os.remove(temp_optimized_model_path)
+        return onnxruntime.InferenceSession(model_path, sess_options = create_session_options(get_graph_optimization_level()), providers = providers)
+    if os.path.isfile(temp_optimized_model_path):
+        os.replace(temp_optimized_model_path, optimized_model_path)
+    return session
+
+def resolve_model_path(model_path : str) -> str:
+    model_name = get_model_name(model_path)
+
+    if '*' in execution_quantized_models or model_name in execution_quantized_models:
+        # Cached variants are derived models already, never quantize them again
+        if is_cached_model(model_path) or get_default_providers() != [ 'CPUExecutionProvider' ]:
+            return model_path
+        try:
+            quantized_model_path = quantize_model(model_path)
+        except Exception as exception:
+            print(f"cannot quantize {model_name}, fallback to float32: {exception}")
+            quantized_model_path = None
+        if quantized_model_path:
+            return quantized_model_path
+    return model_path
+
+def create_session_options(graph_optimization_level : onnxruntime.GraphOptimizationLevel = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL) -> onnxruntime.SessionOptions:
+    session_options = onnxruntime.SessionOptions()
+    session_options.graph_optimization_level = graph_optimization_level
+    session_options.intra_op_num_threads = get_intra_op_thread_count()
+    session_options.inter_op_num_threads = 1
+    session_options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+    # Input shapes are fixed per model, so the planned memory pattern and the arena get reused between runs
+    session_options.enable_mem_pattern = True
+    session_options.enable_cpu_mem_arena = True
+    return session_options
+
+def get_intra_op_thread_count() -> int:
+    if execution_intra_op_thread_count is not None:
+        return execution_intra_op_thread_count
+    return max((os.cpu_count() or 1) // execution_concurrency, 1)
+
+def get_graph_optimization_level() -> onnxruntime.GraphOptimizationLevel:
+    # Layout optimizations of ORT_ENABLE_ALL are cpu specific, keep serialized graphs portable for other providers
+    if get_default_providers() == [ 'CPUExecutionProvider' ]:
+        return onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+
+def can_cache_optimized_model() -> bool:
+    # Providers like CoreML and TensorRT compile nodes into the graph, onnxruntime refuses to serialize those
+    return all(provider in [ 'CPUExecutionProvider', 'CUDAExecutionProvider' ] for provider in get_default_providers())
+
+def get_providers_tag() -> str:
+    providers_tag = '-'.join(provider.replace('ExecutionProvider', '').lower() for provider in get_default_providers())
+    # Graphs optimized for the cpu hold host specific layouts, a shared models dir must not hand them to other hardware
+    return providers_tag + '.' + get_cpu_tag() + '.ort' + onnxruntime.__version__
+
+@lru_cache(maxsize = None)
+def get_cpu_tag() -> str:
+    cpu_features = platform.processor()
+    try:
+        with open('/proc/cpuinfo') as cpuinfo_file:
+            for line in cpuinfo_file:
+                if line.startswith(('flags', 'Features')):
+                    cpu_features = ' '.join(sorted(set(line.split(':', 1)[-1].split()) & CPU_ISA_FLAGS))
+                    break
+    except OSError:
+        pass
+    return platform.machine().lower() + '-' + hashlib.sha1(cpu_features.encode('utf-8')).hexdigest()[:8]
 
 def apply_execution_provider_options(execution_providers: List[str] | None = None) -> List[Any]:
     execution_providers_with_options : List[Any] = []
@@ -23,6 +130,11 @@ def apply_execution_provider_options(execution_providers: List[str] | None = Non
     return execution_providers_with_options
 
 def get_default_providers() -> List[str]:
+    if execution_providers is not None:
+        return execution_providers
+    # Imported here, process workers run on fixed providers and never load torch
+    import torch
+
     if torch.cuda.is_available():
         return ['CUDAExecutionProvider', 'CPUExecutionProvider']
     elif torch.backends.mps.is_available():
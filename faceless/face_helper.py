@@ -129,12 +129,24 @@ def convert_face_landmark_68_to_5(face_landmark_68 : FaceLandmark68) -> FaceLand
     return face_landmark_5
 
 def paste_back(temp_vision_frame : VisionFrame, crop_vision_frame : VisionFrame, crop_mask : Mask, affine_matrix : Matrix) -> VisionFrame:
-    inverse_matrix = cv2.invertAffineTransform(affine_matrix)
-    temp_size = temp_vision_frame.shape[:2][::-1]
-    inverse_mask = cv2.warpAffine(crop_mask, inverse_matrix, temp_size).clip(0, 1)
-    inverse_vision_frame = cv2.warpAffine(crop_vision_frame, inverse_matrix, temp_size, borderMode = cv2.BORDER_REPLICATE)
     paste_vision_frame = temp_vision_frame.copy()
-    paste_vision_frame[:, :, 0] = inverse_mask * inverse_vision_frame[:, :, 0] + (1 - inverse_mask) * temp_vision_frame[:, :, 0]
-    paste_vision_frame[:, :, 1] = inverse_mask * inverse_vision_frame[:, :, 1] + (1 - inverse_mask) * temp_vision_frame[:, :, 1]
-    paste_vision_frame[:, :, 2] = inverse_mask * inverse_vision_frame[:, :, 2] + (1 - inverse_mask) * temp_vision_frame[:, :, 2]
-    return paste_vision_frame
+    return blend_back(paste_vision_frame, crop_vision_frame, crop_mask, affine_matrix)
+
+def blend_back(temp_vision_frame : VisionFrame, crop_vision_frame : VisionFrame, crop_mask : Mask, affine_matrix : Matrix, blend : float = 1.0) -> VisionFrame:
+    # Only the area covered by the inverse warped crop changes, warp and blend within that box in place
+    inverse_matrix = cv2.invertAffineTransform(affine_matrix)
+    crop_height, crop_width = crop_vision_frame.shape[:2]
+    crop_corners = numpy.array([ [ 0, 0 ], [ crop_width, 0 ], [ 0, crop_height ], [ crop_width, crop_height ] ], dtype = numpy.float32)
+    paste_corners = cv2.transform(crop_corners.reshape(1, -1, 2), inverse_matrix).reshape(-1, 2)
+    x1, y1 = numpy.maximum(numpy.floor(paste_corners.min(axis = 0)).astype(int), 0)
+    x2, y2 = numpy.minimum(numpy.ceil(paste_corners.max(axis = 0)).astype(int), temp_vision_frame.shape[:2][::-1])
+    if x2 <= x1 or y2 <= y1:
+        return temp_vision_frame
+    inverse_matrix[:, 2] -= [ x1, y1 ]
+    paste_size = (x2 - x1, y2 - y1)
+    inverse_mask = cv2.warpAffine(crop_mask, inverse_matrix, paste_size).clip(0, 1) * blend
+    inverse_mask = numpy.expand_dims(inverse_mask, axis = 2)
+    inverse_vision_frame = cv2.warpAffine(crop_vision_frame, inverse_matrix, paste_size, borderMode = cv2.BORDER_REPLICATE)
+    paste_vision_frame = temp_vision_frame[y1:y2, x1:x2]
+    paste_vision_frame[:] = inverse_mask * inverse_vision_frame + (1 - inverse_mask) * paste_vision_frame
+    return temp_vision_frame
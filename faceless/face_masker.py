@@ -4,10 +4,10 @@ from functools import lru_cache
 import threading
 import cv2
 import numpy
-import onnxruntime
 
 from .typing import FaceLandmark68, VisionFrame, Mask, Padding, FaceMaskRegion, ModelSet
-from .execution import apply_execution_provider_options
+from .execution import create_inference_session
+from .io_binding import run_session, create_input_buffer
 from .filesystem import resolve_relative_path
 
 FACE_OCCLUDER = None
@@ -47,7 +47,7 @@ def get_face_occluder() -> Any:
     with THREAD_LOCK:
         if FACE_OCCLUDER is None:
             model_path = MODELS['face_occluder']['path']
-            FACE_OCCLUDER = onnxruntime.InferenceSession(model_path, providers = apply_execution_provider_options())
+            FACE_OCCLUDER = create_inference_session(model_path)
     return FACE_OCCLUDER
 
 
@@ -57,7 +57,7 @@ def get_face_parser() -> Any:
     with THREAD_LOCK:
         if FACE_PARSER is None:
             model_path = MODELS['face_parser']['path']
-            FACE_PARSER = onnxruntime.InferenceSession(model_path, providers = apply_execution_provider_options())
+            FACE_PARSER = create_inference_session(model_path)
     return FACE_PARSER
 
 
@@ -89,12 +89,12 @@ def create_static_box_mask(crop_size : Size, face_mask_blur : float, face_mask_p
 
 def create_occlusion_mask(crop_vision_frame : VisionFrame) -> Mask:
     face_occluder = get_face_occluder()
-    prepare_vision_frame = cv2.resize(crop_vision_frame, face_occluder.get_inputs()[0].shape[1:3][::-1])
-    prepare_vision_frame = numpy.expand_dims(prepare_vision_frame, axis = 0).astype(numpy.float32) / 255
-    prepare_vision_frame = prepare_vision_frame.transpose(0, 1, 2, 3)
-    occlusion_mask : Mask = face_occluder.run(None,
+    face_occluder_input = face_occluder.get_inputs()[0]
+    prepare_vision_frame = create_input_buffer(face_occluder, face_occluder_input.name, [ 1 ] + face_occluder_input.shape[1:])
+    numpy.multiply(cv2.resize(crop_vision_frame, face_occluder_input.shape[1:3][::-1]), 1 / 255, out = prepare_vision_frame[0], casting = 'unsafe')
+    occlusion_mask : Mask = run_session(face_occluder,
     {
-        face_occluder.get_inputs()[0].name: prepare_vision_frame
+        face_occluder_input.name: prepare_vision_frame
     })[0][0]
     occlusion_mask = occlusion_mask.transpose(0, 1, 2).clip(0, 1).astype(numpy.float32)
     occlusion_mask = cv2.resize(occlusion_mask, crop_vision_frame.shape[:2][::-1])
@@ -104,12 +104,13 @@ def create_occlusion_mask(crop_vision_frame : VisionFrame) -> Mask:
 
 def create_region_mask(crop_vision_frame : VisionFrame, face_mask_regions : List[FaceMaskRegion]) -> Mask:
     face_parser = get_face_parser()
-    prepare_vision_frame = cv2.flip(cv2.resize(crop_vision_frame, (512, 512)), 1)
-    prepare_vision_frame = numpy.expand_dims(prepare_vision_frame, axis = 0).astype(numpy.float32)[:, :, ::-1] / 127.5 - 1
-    prepare_vision_frame = prepare_vision_frame.transpose(0, 3, 1, 2)
-    region_mask : Mask = face_parser.run(None,
+    face_parser_input_name = face_parser.get_inputs()[0].name
+    prepare_vision_frame = create_input_buffer(face_parser, face_parser_input_name, [ 1, 3, 512, 512 ])
+    numpy.multiply(cv2.flip(cv2.resize(crop_vision_frame, (512, 512)), 1)[:, ::-1].transpose(2, 0, 1), 1 / 127.5, out = prepare_vision_frame[0], casting = 'unsafe')
+    prepare_vision_frame -= 1
+    region_mask : Mask = run_session(face_parser,
     {
-        face_parser.get_inputs()[0].name: prepare_vision_frame
+        face_parser_input_name: prepare_vision_frame
     })[0][0]
     region_mask = numpy.isin(region_mask.argmax(0), [ FACE_MASK_REGIONS[region] for region in face_mask_regions ])
     region_mask = cv2.resize(region_mask.astype(numpy.float32), crop_vision_frame.shape[:2][::-1])
@@ -1,11 +1,17 @@
-from typing import List, Optional
+from typing import Iterator, List, Optional, Tuple
 
+import os
+import shutil
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
-from .vision import pack_resolution, restrict_video_fps
+import numpy
 
-from .typing import Fps, FrameFormat, OutputVideoEncoder, OutputVideoPreset, Resolution
+from .vision import normalize_resolution, pack_resolution, restrict_video_fps
+
+from .typing import Fps, FrameFormat, OutputVideoEncoder, OutputVideoPreset, Resolution, VisionFrame
 from .filesystem import get_temp_frames_pattern
+from .frame_store import FRAME_STORE_HEADER_SIZE, get_frame_store_path, has_frame_store, write_frame_store
 
 def run_ffmpeg(args : List[str]):
     commands = [ 'ffmpeg', '-hide_banner', '-loglevel', 'error' ]
@@ -24,66 +30,220 @@ def run_ffmpeg(args : List[str]):
         print(', '.join([msg, stderr, stdout]))
     return code == 0
 
-def extract_frames(video_path: str, frames_path: str, video_resolution : Resolution, video_fps : Fps, trim_frame_start : Optional[int] = None, trim_frame_end: Optional[int] = None, frame_format: FrameFormat = 'png') -> bool:
+def extract_frames(video_path: str, frames_path: str, video_resolution : Resolution, video_fps : Fps, trim_frame_start : Optional[int] = None, trim_frame_end: Optional[int] = None, frame_format: FrameFormat = 'png', process_count : int = 1) -> bool:
+    if process_count > 1:
+        keyframes, frame_total = detect_keyframes(video_path, video_fps)
+        frame_start = trim_frame_start or 0
+        frame_end = min(trim_frame_end, frame_total) if trim_frame_end is not None else frame_total
+        frame_segments = create_frame_segments(keyframes, frame_start, frame_end if trim_frame_end is not None else None, process_count)
+        if len(frame_segments) > 1 and frame_end > frame_start:
+            if extract_frame_segments(video_path, frames_path, video_resolution, video_fps, frame_segments, frame_end, frame_format):
+                return True
+            # A boundary did not line up, start over with a single pass
+            print("segmented extraction mismatch, fallback to a single process")
     temp_frames_pattern = get_temp_frames_pattern(frames_path, '%04d', frame_format)
     commands = [ '-hwaccel', 'auto', '-i', video_path, '-q:v', '0' ]
+    commands.extend([ '-vf', create_extract_filter(video_resolution, video_fps, trim_frame_start, trim_frame_end) ])
+    commands.extend([ '-vsync', '0', temp_frames_pattern ])
+    return run_ffmpeg(commands)
+
+def detect_keyframes(video_path: str, video_fps : Fps) -> Tuple[List[Tuple[int, float]], int]:
+    # Packets are only demuxed, frame numbers are their positions in presentation order, the frame total comes along
+    commands = [ 'ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', video_path ]
+    try:
+        output = subprocess.run(commands, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, timeout = 300).stdout.decode('utf-8')
+    except (OSError, subprocess.TimeoutExpired):
+        return [], 0
+    packets : List[Tuple[float, bool]] = []
+    for line in output.splitlines():
+        pts_time, _, flags = line.strip().partition(',')
+        if pts_time not in [ '', 'N/A' ]:
+            packets.append((float(pts_time), 'K' in flags))
+    frame_times = sorted(pts_time for pts_time, _ in packets)
+    # Variable frame rates make the fps filter drop or repeat frames, numbering by position would not match the output
+    if any(abs(next_frame_time - frame_time - 1 / video_fps) > 0.5 / video_fps for frame_time, next_frame_time in zip(frame_times, frame_times[1:])):
+        return [], len(frame_times)
+    frame_numbers = { frame_time: frame_number for frame_number, frame_time in enumerate(frame_times) }
+    keyframes : List[Tuple[int, float]] = []
+    later_frame_time = float('inf')
+
+    # Open gop keyframes are followed by packets shown before them, seeking there would drop or add frames
+    for pts_time, is_keyframe in reversed(packets):
+        if is_keyframe and later_frame_time >= pts_time:
+            keyframes.append((frame_numbers[pts_time], pts_time))
+        later_frame_time = min(later_frame_time, pts_time)
+    return sorted(keyframes), len(frame_times)
+
+def create_frame_segments(keyframes : List[Tuple[int, float]], frame_start : int, frame_end : Optional[int], segment_count : int) -> List[Tuple[int, Optional[int], Optional[float]]]:
+    # Segments after the first start on a keyframe, so every process begins decoding right at its first frame
+    keyframes = [ keyframe for keyframe in keyframes if keyframe[0] > frame_start and (frame_end is None or keyframe[0] < frame_end) ]
+    boundary_keyframes = sorted(set(keyframes[len(keyframes) * index // segment_count] for index in range(1, segment_count) if keyframes))
+    segment_starts = [ (frame_start, None) ] + boundary_keyframes
+    segment_ends : List[Optional[int]] = [ keyframe[0] for keyframe in boundary_keyframes ] + [ frame_end ]
+    return [ (segment_start, segment_end, seek_time) for (segment_start, seek_time), segment_end in zip(segment_starts, segment_ends) ]
 
+def extract_frame_segments(video_path: str, frames_path: str, video_resolution : Resolution, video_fps : Fps, frame_segments : List[Tuple[int, Optional[int], Optional[float]]], frame_end : int, frame_format: FrameFormat = 'png') -> bool:
+    # Each segment writes into a directory of its own, frames only move into the shared numbering once all of them add up
+    segment_dirs = [ os.path.join(frames_path, '.segment_' + str(index)) for index in range(len(frame_segments)) ]
+    segment_commands = []
+
+    for (segment_start, segment_end, seek_time), segment_dir in zip(frame_segments, segment_dirs):
+        os.makedirs(segment_dir, exist_ok = True)
+        if seek_time is None:
+            commands = [ '-hwaccel', 'auto', '-i', video_path, '-q:v', '0', '-vf', create_extract_filter(video_resolution, video_fps, segment_start or None, segment_end) ]
+        else:
+            # A quarter frame past the keyframe timestamp, the inexact seek then starts decoding on that keyframe without dropping it
+            commands = [ '-hwaccel', 'auto', '-seek_timestamp', '1', '-noaccurate_seek', '-ss', str(seek_time + 0.25 / video_fps), '-i', video_path, '-q:v', '0', '-vf', create_extract_filter(video_resolution, video_fps) ]
+            if segment_end is not None:
+                commands.extend([ '-frames:v', str(segment_end - segment_start) ])
+        commands.extend([ '-vsync', '0', get_temp_frames_pattern(segment_dir, '%04d', frame_format) ])
+        segment_commands.append(commands)
+    try:
+        with ThreadPoolExecutor(max_workers = len(segment_commands)) as executor:
+            if not all(executor.map(run_ffmpeg, segment_commands)):
+                return False
+
+        # A segment holding more or fewer frames than its range means its boundary is off, the open ended last one checks against the probed total
+        segment_frame_filenames = [ sorted(os.listdir(segment_dir), key = lambda frame_filename: int(os.path.splitext(frame_filename)[0])) for segment_dir in segment_dirs ]
+        for (segment_start, segment_end, _), frame_filenames in zip(frame_segments, segment_frame_filenames):
+            if len(frame_filenames) != (segment_end if segment_end is not None else frame_end) - segment_start:
+                return False
+        frame_number = 1
+        for segment_dir, frame_filenames in zip(segment_dirs, segment_frame_filenames):
+            for frame_filename in frame_filenames:
+                os.replace(os.path.join(segment_dir, frame_filename), get_temp_frames_pattern(frames_path, '%04d', frame_format) % frame_number)
+                frame_number += 1
+        return True
+    finally:
+        for segment_dir in segment_dirs:
+            shutil.rmtree(segment_dir, ignore_errors = True)
+
+def extract_frame_store(video_path: str, frames_dir: str, video_resolution : Resolution, video_fps : Fps, trim_frame_start : Optional[int] = None, trim_frame_end: Optional[int] = None) -> bool:
+    # Decoded once into a single raw file, processors map it instead of decoding png frames
+    try:
+        return write_frame_store(frames_dir, read_video_frames(video_path, video_resolution, video_fps, trim_frame_start, trim_frame_end)) > 0
+    except Exception as exception:
+        print(f"cannot extract frame store: {exception}")
+        return False
+
+def create_extract_filter(video_resolution : Resolution, video_fps : Fps, trim_frame_start : Optional[int] = None, trim_frame_end : Optional[int] = None) -> str:
     format_resolution = pack_resolution(video_resolution)
 
     if trim_frame_start is not None and trim_frame_end is not None:
-        commands.extend([ '-vf', 'trim=start_frame=' + str(trim_frame_start) + ':end_frame=' + str(trim_frame_end) + ',scale=' + format_resolution + ',fps=' + str(video_fps) ])
-    elif trim_frame_start is not None:
-        commands.extend([ '-vf', 'trim=start_frame=' + str(trim_frame_start) + ',scale=' + format_resolution + ',fps=' + str(video_fps) ])
-    elif trim_frame_end is not None:
-        commands.extend([ '-vf', 'trim=end_frame=' + str(trim_frame_end) + ',scale=' + format_resolution + ',fps=' + str(video_fps) ])
-    else:
-        commands.extend([ '-vf', 'scale=' + format_resolution + ',fps=' + str(video_fps) ])
-    commands.extend([ '-vsync', '0', temp_frames_pattern ])
-    return run_ffmpeg(commands)
+        return 'trim=start_frame=' + str(trim_frame_start) + ':end_frame=' + str(trim_frame_end) + ',scale=' + format_resolution + ',fps=' + str(video_fps)
+    if trim_frame_start is not None:
+        return 'trim=start_frame=' + str(trim_frame_start) + ',scale=' + format_resolution + ',fps=' + str(video_fps)
+    if trim_frame_end is not None:
+        return 'trim=end_frame=' + str(trim_frame_end) + ',scale=' + format_resolution + ',fps=' + str(video_fps)
+    return 'scale=' + format_resolution + ',fps=' + str(video_fps)
+
+def read_video_frames(video_path: str, video_resolution : Resolution, video_fps : Fps, trim_frame_start : Optional[int] = None, trim_frame_end: Optional[int] = None) -> Iterator[VisionFrame]:
+    # Same frames as extract_frames, decoded as raw bgr24 from the stdout pipe instead of png files
+    width, height = normalize_resolution(video_resolution)
+    commands = [ 'ffmpeg', '-hide_banner', '-loglevel', 'error', '-hwaccel', 'auto', '-i', video_path ]
+    commands.extend([ '-vf', create_extract_filter(video_resolution, video_fps, trim_frame_start, trim_frame_end) ])
+    commands.extend([ '-vsync', '0', '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-' ])
+    process = subprocess.Popen(commands, stderr = subprocess.PIPE, stdout = subprocess.PIPE)
+
+    try:
+        while True:
+            # Every frame gets its own writable buffer, processors paste into the frames in place
+            vision_frame = numpy.empty((height, width, 3), dtype = numpy.uint8)
+            if process.stdout.readinto(memoryview(vision_frame).cast('B')) < vision_frame.nbytes:
+                break
+            yield vision_frame
+    except GeneratorExit:
+        # The consumer stopped early, do not leave the decoder blocked on a full pipe
+        process.kill()
+        process.wait()
+        raise
+    finally:
+        process.stdout.close()
+    if process.wait() != 0:
+        raise Exception('cannot decode ' + video_path + ': ' + process.stderr.read().decode('utf-8').strip())
 
-def merge_frames(video_path: str, frames_dir: str, output_path: str, video_resolution: Resolution, video_fps: Fps, output_video_encoder: OutputVideoEncoder = 'libx264', output_video_quality: int = 80, output_video_preset: OutputVideoPreset = 'veryfast', frame_format: FrameFormat = 'png') -> bool:
+def write_video_frames(vision_frames : Iterator[VisionFrame], video_path: str, output_path: str, video_resolution: Resolution, video_fps: Fps, output_video_encoder: OutputVideoEncoder = 'libx264', output_video_quality: int = 80, output_video_preset: OutputVideoPreset = 'veryfast') -> bool:
     temp_video_fps = restrict_video_fps(video_path, video_fps)
-    temp_frames_pattern = get_temp_frames_pattern(frames_dir, '%04d', frame_format)
-    commands = [ '-hwaccel', 'auto', '-s', pack_resolution(video_resolution), '-r', str(temp_video_fps), '-i', temp_frames_pattern, '-c:v', output_video_encoder ]
+    commands = [ 'ffmpeg', '-hide_banner', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', pack_resolution(video_resolution), '-r', str(temp_video_fps), '-i', '-', '-c:v', output_video_encoder ]
+    commands.extend(create_encoder_options(output_video_encoder, output_video_quality, output_video_preset))
+    commands.extend([ '-vf', 'framerate=fps=' + str(video_fps), '-pix_fmt', 'yuv420p', '-colorspace', 'bt709', '-y', output_path ])
+    process = subprocess.Popen(commands, stdin = subprocess.PIPE, stderr = subprocess.PIPE, stdout = subprocess.DEVNULL)
+
+    try:
+        for vision_frame in vision_frames:
+            process.stdin.write(numpy.ascontiguousarray(vision_frame).data)
+    except BrokenPipeError:
+        # The encoder exited early, its error is reported below
+        pass
+    except Exception:
+        process.kill()
+        process.wait()
+        raise
+    try:
+        process.stdin.close()
+    except BrokenPipeError:
+        pass
+    code = process.wait()
 
+    if code != 0:
+        print(', '.join([ f"code: {code}", "stderr: " + process.stderr.read().decode('utf-8').strip() ]))
+    return code == 0
+
+def create_encoder_options(output_video_encoder: OutputVideoEncoder, output_video_quality: int, output_video_preset: OutputVideoPreset) -> List[str]:
     if output_video_encoder in [ 'libx264', 'libx265' ]:
         output_video_compression = round(51 - (output_video_quality * 0.51))
-        commands.extend([ '-crf', str(output_video_compression), '-preset', output_video_preset ])
+        return [ '-crf', str(output_video_compression), '-preset', output_video_preset ]
     if output_video_encoder in [ 'libvpx-vp9' ]:
         output_video_compression = round(63 - (output_video_quality * 0.63))
-        commands.extend([ '-crf', str(output_video_compression) ])
+        return [ '-crf', str(output_video_compression) ]
     if output_video_encoder in [ 'h264_nvenc', 'hevc_nvenc' ]:
         output_video_compression = round(51 - (output_video_quality * 0.51))
-        commands.extend([ '-cq', str(output_video_compression), '-preset', output_video_preset ])
+        return [ '-cq', str(output_video_compression), '-preset', output_video_preset ]
     if output_video_encoder in [ 'h264_amf', 'hevc_amf' ]:
         output_video_compression = round(51 - (output_video_quality * 0.51))
-        commands.extend([ '-qp_i', str(output_video_compression), '-qp_p', str(output_video_compression), '-quality', map_amf_preset(output_video_preset) ])
-    commands.extend([ '-vf', 'framerate=fps=' + str(video_fps), '-pix_fmt', 'yuv420p', '-colorspace', 'bt709', '-y', output_path ])
+        return [ '-qp_i', str(output_video_compression), '-qp_p', str(output_video_compression), '-quality', map_amf_preset(output_video_preset) ]
+    return []
+
+def merge_frames(video_path: str, frames_dir: str, output_path: str, video_resolution: Resolution, video_fps: Fps, output_video_encoder: OutputVideoEncoder = 'libx264', output_video_quality: int = 80, output_video_preset: OutputVideoPreset = 'veryfast', frame_format: FrameFormat = 'png', masks_dir: Optional[str] = None) -> bool:
+    temp_video_fps = restrict_video_fps(video_path, video_fps)
+    temp_frames_pattern = get_temp_frames_pattern(frames_dir, '%04d', frame_format)
+    if has_frame_store(frames_dir):
+        # The store is rawvideo behind a fixed size header, ffmpeg reads it as is
+        commands = [ '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', pack_resolution(video_resolution), '-r', str(temp_video_fps), '-skip_initial_bytes', str(FRAME_STORE_HEADER_SIZE), '-i', get_frame_store_path(frames_dir) ]
+    else:
+        commands = [ '-hwaccel', 'auto', '-s', pack_resolution(video_resolution), '-r', str(temp_video_fps), '-i', temp_frames_pattern ]
+
+    if masks_dir:
+        commands.extend([ '-r', str(temp_video_fps), '-i', get_temp_frames_pattern(masks_dir, '%04d', 'png') ])
+    commands.extend([ '-c:v', output_video_encoder ])
+    commands.extend(create_encoder_options(output_video_encoder, output_video_quality, output_video_preset))
+    if masks_dir:
+        # Same result as the RGBA frames, the masked frames end up on black once the alpha is dropped
+        commands.extend([ '-filter_complex', '[0:v][1:v]alphamerge[fg];color=c=black:s=' + pack_resolution(video_resolution) + ':r=' + str(temp_video_fps) + '[bg];[bg][fg]overlay=shortest=1,framerate=fps=' + str(video_fps) ])
+    else:
+        commands.extend([ '-vf', 'framerate=fps=' + str(video_fps) ])
+    commands.extend([ '-pix_fmt', 'yuv420p', '-colorspace', 'bt709', '-y', output_path ])
     return run_ffmpeg(commands)
 
 # ffmpeg -i ~/Downloads/temp/bg.mp4 -framerate 30 -i %04d.png -filter_complex "[0:v]scale=528:960:force_original_aspect_ratio=increase,crop=528:960[bg];[1:v]format=rgba[overlay];[bg][overlay]overlay=shortest=1" -pix_fmt yuv420p -c:a copy output_final.mp4
-def merge_frames_and_bg_video(video_path: str, bg_video_path: str, frames_dir: str, output_path: str, video_resolution: Resolution, video_fps: Fps, output_video_encoder: OutputVideoEncoder = 'libx264', output_video_quality: int = 80, output_video_preset: OutputVideoPreset = 'veryfast', frame_format: FrameFormat = 'png'):
+def merge_frames_and_bg_video(video_path: str, bg_video_path: str, frames_dir: str, output_path: str, video_resolution: Resolution, video_fps: Fps, output_video_encoder: OutputVideoEncoder = 'libx264', output_video_quality: int = 80, output_video_preset: OutputVideoPreset = 'veryfast', frame_format: FrameFormat = 'png', masks_dir: Optional[str] = None):
     temp_video_fps = restrict_video_fps(video_path, video_fps)
     temp_frames_pattern = get_temp_frames_pattern(frames_dir, '%04d', frame_format)
-    video_resolution[0]
-    commands = [ '-hwaccel', 'auto', '-r', str(temp_video_fps), '-i', bg_video_path, '-i', temp_frames_pattern, '-c:v', output_video_encoder ]
+    commands = [ '-hwaccel', 'auto', '-r', str(temp_video_fps), '-i', bg_video_path, '-i', temp_frames_pattern ]
+
+    if masks_dir:
+        commands.extend([ '-i', get_temp_frames_pattern(masks_dir, '%04d', 'png') ])
+    commands.extend([ '-c:v', output_video_encoder ])
 
     width = video_resolution[0]
     height = video_resolution[1]
-    commands.extend(["-filter_complex", f"[0:v]scale={width}:{height}:force_original_aspect_ratio=increase,crop={width}:{height}[bg];[1:v]format=rgba[overlay];[bg][overlay]overlay=shortest=1"])
+    if masks_dir:
+        # The RGB frames and the grayscale masks are joined here instead of encoding RGBA frames
+        commands.extend(["-filter_complex", f"[0:v]scale={width}:{height}:force_original_aspect_ratio=increase,crop={width}:{height}[bg];[1:v][2:v]alphamerge[overlay];[bg][overlay]overlay=shortest=1"])
+    else:
+        commands.extend(["-filter_complex", f"[0:v]scale={width}:{height}:force_original_aspect_ratio=increase,crop={width}:{height}[bg];[1:v]format=rgba[overlay];[bg][overlay]overlay=shortest=1"])
 
-    if output_video_encoder in [ 'libx264', 'libx265' ]:
-        output_video_compression = round(51 - (output_video_quality * 0.51))
-        commands.extend([ '-crf', str(output_video_compression), '-preset', output_video_preset ])
-    if output_video_encoder in [ 'libvpx-vp9' ]:
-        output_video_compression = round(63 - (output_video_quality * 0.63))
-        commands.extend([ '-crf', str(output_video_compression) ])
-    if output_video_encoder in [ 'h264_nvenc', 'hevc_nvenc' ]:
-        output_video_compression = round(51 - (output_video_quality * 0.51))
-        commands.extend([ '-cq', str(output_video_compression), '-preset', output_video_preset ])
-    if output_video_encoder in [ 'h264_amf', 'hevc_amf' ]:
-        output_video_compression = round(51 - (output_video_quality * 0.51))
-        commands.extend([ '-qp_i', str(output_video_compression), '-qp_p', str(output_video_compression), '-quality', map_amf_preset(output_video_preset) ])
+    commands.extend(create_encoder_options(output_video_encoder, output_video_quality, output_video_preset))
     commands.extend(['-pix_fmt', 'yuv420p', '-colorspace', 'bt709', '-y', output_path])
     return run_ffmpeg(commands)
 
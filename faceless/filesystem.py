@@ -4,7 +4,12 @@ import filetype
 
 import folder_paths
 
+from typing import List
+
 from .typing import FrameFormat, ModelType
+from .frame_store import has_frame_store, list_frame_store_names
+
+FRAME_EXTENSIONS = ('.jpg', '.png', '.bmp')
 
 def is_file(file_path : str) -> bool:
     return bool(file_path and os.path.isfile(file_path))
@@ -16,6 +21,11 @@ def is_image(image_path : str) -> bool:
 def is_video(video_path : str) -> bool:
     return is_file(video_path) and filetype.helpers.is_video(video_path)
 
+def list_frame_filenames(frames_dir : str) -> List[str]:
+    if has_frame_store(frames_dir):
+        return list_frame_store_names(frames_dir)
+    return sorted(filename for filename in os.listdir(frames_dir) if filename.endswith(FRAME_EXTENSIONS))
+
 def get_temp_frames_pattern(target_path : str, temp_frame_prefix : str, format: FrameFormat) -> str:
     return os.path.join(target_path, temp_frame_prefix + '.' + format)
 
@@ -0,0 +1,91 @@
+from typing import Optional, Tuple
+import threading
+
+import cv2
+import numpy
+
+from .typing import Mask, VisionFrame
+
+
+class FrameGate:
+
+    def __init__(self, diff_threshold : float, keyframe_interval : int = 12, motion_compensation : bool = False, gate_size : int = 64) -> None:
+        self._diff_threshold = diff_threshold
+        self._keyframe_interval = max(keyframe_interval, 1)
+        self._motion_compensation = motion_compensation
+        self._gate_size = gate_size
+        self._lock = threading.Lock()
+        self._key_gate_frame : Optional[numpy.ndarray] = None
+        self._key_scale = 1.0
+        self._key_mask : Optional[Mask] = None
+        self._reuse_count = 0
+        self._skip_count = 0
+        self._frame_count = 0
+
+    def check(self, vision_frame : VisionFrame) -> Optional[Tuple[float, float]]:
+        # None asks for a full inference, otherwise the key mask is reused with the returned pixel shift
+        gate_frame, scale = create_gate_frame(vision_frame, self._gate_size)
+
+        with self._lock:
+            self._frame_count += 1
+            shift = self._find_shift(gate_frame, scale)
+            if shift is None:
+                self._key_gate_frame = gate_frame
+                self._key_scale = scale
+                self._reuse_count = 0
+                return None
+            self._reuse_count += 1
+            self._skip_count += 1
+            return shift
+
+    def set_key_mask(self, mask : Mask) -> None:
+        with self._lock:
+            self._key_mask = mask
+
+    def get_mask(self, shift : Tuple[float, float]) -> Mask:
+        with self._lock:
+            key_mask = self._key_mask
+        if key_mask is None:
+            raise Exception("frame gate has no key mask")
+        return shift_mask(key_mask, shift)
+
+    def get_skip_ratio(self) -> float:
+        with self._lock:
+            return self._skip_count / self._frame_count if self._frame_count else 0.0
+
+    def report(self) -> None:
+        print(f"frame gate: {self._skip_count}/{self._frame_count} frames skipped inference ({self.get_skip_ratio() * 100:.1f}%)")
+
+    def _find_shift(self, gate_frame : numpy.ndarray, scale : float) -> Optional[Tuple[float, float]]:
+        if self._key_gate_frame is None or self._key_gate_frame.shape != gate_frame.shape or self._reuse_count + 1 >= self._keyframe_interval:
+            return None
+        # Compare with the keyframe, not the previous frame, so slow drift still forces an inference
+        key_gate_frame = self._key_gate_frame
+        shift_x, shift_y = 0.0, 0.0
+        if self._motion_compensation:
+            (shift_x, shift_y), _ = cv2.phaseCorrelate(key_gate_frame, gate_frame)
+            key_gate_frame = shift_mask(key_gate_frame, (shift_x, shift_y))
+        if calc_gate_difference(key_gate_frame, gate_frame) > self._diff_threshold:
+            return None
+        return shift_x * scale, shift_y * scale
+
+
+def create_gate_frame(vision_frame : VisionFrame, gate_size : int) -> Tuple[numpy.ndarray, float]:
+    height, width = vision_frame.shape[:2]
+    scale = max(width, height) / gate_size
+    gate_frame = cv2.resize(vision_frame, (max(round(width / scale), 1), max(round(height / scale), 1)), interpolation = cv2.INTER_AREA)
+    if gate_frame.ndim == 3:
+        gate_frame = cv2.cvtColor(gate_frame, cv2.COLOR_RGB2GRAY)
+    return gate_frame.astype(numpy.float32), scale
+
+
+def calc_gate_difference(gate_frame : numpy.ndarray, other_gate_frame : numpy.ndarray) -> float:
+    return float(numpy.mean(numpy.abs(gate_frame - other_gate_frame)))
+
+
+def shift_mask(mask : Mask, shift : Tuple[float, float]) -> Mask:
+    if shift == (0.0, 0.0):
+        return mask
+    height, width = mask.shape[:2]
+    shift_matrix = numpy.float32([ [ 1, 0, shift[0] ], [ 0, 1, shift[1] ] ])
+    return cv2.warpAffine(mask, shift_matrix, (width, height), borderMode = cv2.BORDER_REPLICATE)
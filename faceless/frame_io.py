@@ -0,0 +1,139 @@
+from typing import Any, Callable, Deque, Iterable, Iterator, List, Optional, Set
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+import os
+import threading
+
+import cv2
+import numpy
+from PIL import Image
+
+from .typing import VisionFrame
+from .vision import read_image
+from .frame_store import is_frame_store_path, read_store_frame, write_store_frame
+
+# zlib level of written png frames, 0 stores them raw, 1 is the fastest compression and 9 the smallest file
+frame_png_compression : int = int(os.environ.get('FACELESS_PNG_COMPRESSION', '1'))
+frame_io_thread_count : int = int(os.environ.get('FACELESS_FRAME_IO_THREADS', '2'))
+
+
+def is_png_path(frame_path : str) -> bool:
+    return frame_path.lower().endswith('.png')
+
+
+def read_frame(frame_path : str) -> Optional[VisionFrame]:
+    if is_frame_store_path(frame_path):
+        return read_store_frame(frame_path)
+    return read_image(frame_path)
+
+
+def read_frame_image(frame_path : str) -> Image.Image:
+    if is_frame_store_path(frame_path):
+        return Image.fromarray(read_store_frame(frame_path)[:, :, ::-1])
+    frame_image = Image.open(frame_path)
+    # Decode on the reading thread, Image.open alone only parses the header
+    frame_image.load()
+    return frame_image
+
+
+def write_frame(frame_path : str, vision_frame : VisionFrame) -> bool:
+    if not frame_path:
+        return False
+    if is_frame_store_path(frame_path):
+        return write_store_frame(frame_path, vision_frame)
+    if is_png_path(frame_path):
+        return cv2.imwrite(frame_path, vision_frame, [ cv2.IMWRITE_PNG_COMPRESSION, frame_png_compression ])
+    return cv2.imwrite(frame_path, vision_frame)
+
+
+def write_frame_image(frame_path : str, frame_image : Image.Image) -> None:
+    if is_frame_store_path(frame_path):
+        # Stored frames have no alpha channel, callers keep alpha in separate masks
+        if not write_store_frame(frame_path, numpy.array(frame_image.convert('RGB'))[:, :, ::-1]):
+            raise Exception(f"cannot write frame {frame_path}")
+    elif is_png_path(frame_path):
+        frame_image.save(frame_path, compress_level = frame_png_compression)
+    else:
+        frame_image.save(frame_path)
+
+
+def prefetch_frames(frame_paths : List[str], read : Callable[[str], Any] = read_frame, prefetch_count : int = 8, thread_count : Optional[int] = None) -> Iterator[Any]:
+    # Frames come back in order while the next ones are decoded in the background
+    return map_frames(read, frame_paths, prefetch_count, thread_count or frame_io_thread_count)
+
+
+def map_frames(process : Callable[[Any], Any], items : Iterable[Any], in_flight_count : int, thread_count : int) -> Iterator[Any]:
+    # Ordered like the input, at most in_flight_count items are taken from it ahead of the consumer
+    with ThreadPoolExecutor(max_workers = max(thread_count, 1), thread_name_prefix = 'faceless-frame') as executor:
+        futures : Deque[Future] = deque()
+
+        for item in items:
+            futures.append(executor.submit(process, item))
+            if len(futures) >= max(in_flight_count, 1):
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+
+class FrameWriter:
+
+    def __init__(self, thread_count : Optional[int] = None, max_pending_count : int = 16) -> None:
+        self._executor = ThreadPoolExecutor(max_workers = thread_count or frame_io_thread_count, thread_name_prefix = 'faceless-writer')
+        # Bounds the encoded frames held in memory, submit blocks once the writers fall behind
+        self._pending = threading.Semaphore(max(max_pending_count, 1))
+        self._lock = threading.Lock()
+        self._futures : Set[Future] = set()
+        self._error : Optional[BaseException] = None
+
+    def __enter__(self) -> 'FrameWriter':
+        return self
+
+    def __exit__(self, exception_type, exception, traceback) -> None:
+        if exception_type is None:
+            self.close()
+        else:
+            # Keep the original error, just let the queued writes settle
+            self._executor.shutdown(wait = True)
+
+    def write(self, frame_path : str, vision_frame : VisionFrame) -> Future:
+        def write_or_raise() -> None:
+            if not write_frame(frame_path, vision_frame):
+                raise Exception(f"cannot write frame {frame_path}")
+        return self.submit(write_or_raise)
+
+    def write_image(self, frame_path : str, frame_image : Image.Image) -> Future:
+        return self.submit(lambda: write_frame_image(frame_path, frame_image))
+
+    def submit(self, write : Callable[[], Any]) -> Future:
+        self._raise_error()
+        self._pending.acquire()
+        future = self._executor.submit(write)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._complete)
+        return future
+
+    def flush(self) -> None:
+        with self._lock:
+            futures = list(self._futures)
+        wait(futures)
+        self._raise_error()
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown(wait = True)
+
+    def _complete(self, future : Future) -> None:
+        with self._lock:
+            self._futures.discard(future)
+            if self._error is None and not future.cancelled() and future.exception() is not None:
+                self._error = future.exception()
+        self._pending.release()
+
+    def _raise_error(self) -> None:
+        with self._lock:
+            error = self._error
+        if error is not None:
+            raise error
@@ -0,0 +1,117 @@
+from typing import Any, Dict, List, Optional
+import hashlib
+import json
+import os
+import threading
+
+from .typing import FrameManifestEntry
+
+FRAME_MANIFEST_NAME = '.faceless_manifest.json'
+
+
+def create_processor_key(processor_name : str, processor_options : Dict[str, Any]) -> str:
+    options_hash = hashlib.sha1(json.dumps(processor_options, sort_keys = True, default = str).encode('utf-8')).hexdigest()
+    return processor_name + ':' + options_hash[:16]
+
+
+class FrameManifest:
+
+    def __init__(self, frames_dir : str, processor_key : str, processor_options : Dict[str, Any], flush_interval : int = 32) -> None:
+        self._manifest_path = os.path.join(frames_dir, FRAME_MANIFEST_NAME)
+        self._processor_key = processor_key
+        self._flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._dirty_count = 0
+        self._manifest = self._load()
+        self._manifest['processors'][processor_key] = processor_options
+
+    def filter_pending(self, frame_names : List[str]) -> List[str]:
+        with self._lock:
+            return [ frame_name for frame_name in frame_names if self._get_status(frame_name) != 'done' ]
+
+    def filter_failed(self, frame_names : List[str]) -> List[str]:
+        with self._lock:
+            return [ frame_name for frame_name in frame_names if self._get_status(frame_name) == 'failed' ]
+
+    def get_entry(self, frame_name : str) -> Optional[FrameManifestEntry]:
+        with self._lock:
+            return self._manifest['frames'].get(frame_name, {}).get(self._processor_key)
+
+    def count_face_models(self, frame_names : List[str]) -> Dict[str, int]:
+        face_model_counts : Dict[str, int] = {}
+        with self._lock:
+            for frame_name in frame_names:
+                entry = self._manifest['frames'].get(frame_name, {}).get(self._processor_key) or {}
+                for face_model, face_count in entry.get('face_models', {}).items():
+                    face_model_counts[face_model] = face_model_counts.get(face_model, 0) + face_count
+        return face_model_counts
+
+    def filter_modified(self, frame_names : List[str]) -> List[str]:
+        with self._lock:
+            return [ frame_name for frame_name in frame_names if self._get_status(frame_name) == 'done' and self._manifest['frames'][frame_name][self._processor_key].get('modified', True) ]
+
+    def filter_without_faces(self, frame_names : List[str]) -> List[str]:
+        with self._lock:
+            return [ frame_name for frame_name in frame_names if self._get_status(frame_name) == 'done' and self._manifest['frames'][frame_name][self._processor_key].get('face_count') == 0 ]
+
+    def mark(self, frame_name : str, error : Optional[str] = None, modified : bool = False, face_count : int = 0, face_models : Optional[Dict[str, int]] = None) -> None:
+        with self._lock:
+            frame_entries = self._manifest['frames'].setdefault(frame_name, {})
+            entry : FrameManifestEntry = frame_entries.get(self._processor_key) or { 'status': 'pending', 'attempts': 0, 'modified': False, 'face_count': 0, 'face_models': {}, 'error': None, 'generation': 0 }
+            entry['attempts'] += 1
+            entry['status'] = 'failed' if error else 'done'
+            entry['modified'] = modified
+            entry['face_count'] = face_count
+            entry['face_models'] = face_models or {}
+            entry['error'] = error
+            # A rewritten frame is new input for every other processor, their entries go stale
+            if modified and not error:
+                self._manifest['generations'][frame_name] = self._get_generation(frame_name) + 1
+            entry['generation'] = self._get_generation(frame_name)
+            frame_entries[self._processor_key] = entry
+            self._dirty_count += 1
+            should_flush = self._dirty_count >= self._flush_interval
+        if should_flush:
+            self.flush()
+
+    def quarantine(self, frame_names : List[str]) -> None:
+        with self._lock:
+            for frame_name in frame_names:
+                entry = self._manifest['frames'].get(frame_name, {}).get(self._processor_key)
+                if entry:
+                    entry['status'] = 'quarantined'
+                    self._dirty_count += 1
+        for frame_name in frame_names:
+            print(f"quarantined frame {frame_name}: {self.get_entry(frame_name).get('error')}")
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self._dirty_count and os.path.exists(self._manifest_path):
+                return
+            temp_manifest_path = self._manifest_path + '.tmp'
+            with open(temp_manifest_path, 'w') as manifest_file:
+                json.dump(self._manifest, manifest_file)
+            # Replace atomically, an interrupted flush leaves the previous manifest intact
+            os.replace(temp_manifest_path, self._manifest_path)
+            self._dirty_count = 0
+
+    def _get_status(self, frame_name : str) -> str:
+        entry = self._manifest['frames'].get(frame_name, {}).get(self._processor_key)
+        if entry and entry.get('generation', 0) == self._get_generation(frame_name):
+            return entry['status']
+        return 'pending'
+
+    def _get_generation(self, frame_name : str) -> int:
+        return self._manifest['generations'].get(frame_name, 0)
+
+    def _load(self) -> Dict[str, Any]:
+        if os.path.isfile(self._manifest_path):
+            try:
+                with open(self._manifest_path) as manifest_file:
+                    manifest = json.load(manifest_file)
+                if isinstance(manifest.get('frames'), dict) and isinstance(manifest.get('processors'), dict):
+                    manifest.setdefault('generations', {})
+                    return manifest
+            except (OSError, ValueError):
+                print(f"ignore unreadable frame manifest {self._manifest_path}")
+        return { 'version': 1, 'processors': {}, 'generations': {}, 'frames': {} }
@@ -0,0 +1,112 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+import os
+import struct
+import threading
+
+import numpy
+
+from .typing import VisionFrame
+
+THREAD_LOCK : threading.Lock = threading.Lock()
+# Open stores keyed by path and inode, a store written again gets a new inode and a new mapping
+FRAME_STORES : Dict[Tuple[str, int], numpy.memmap] = {}
+FRAME_STORE_NAME = 'frames.raw'
+FRAME_STORE_MAGIC = b'FLFS'
+FRAME_STORE_VERSION = 1
+FRAME_STORE_HEADER_SIZE = 64
+FRAME_STORE_EXTENSION = '.raw'
+
+
+def get_frame_store_path(frames_dir : str) -> str:
+    return os.path.join(frames_dir, FRAME_STORE_NAME)
+
+
+def has_frame_store(frames_dir : str) -> bool:
+    return os.path.isfile(get_frame_store_path(frames_dir))
+
+
+def pack_frame_store_header(frame_count : int, height : int, width : int) -> bytes:
+    return (FRAME_STORE_MAGIC + struct.pack('<IIII', FRAME_STORE_VERSION, frame_count, height, width)).ljust(FRAME_STORE_HEADER_SIZE, b'\0')
+
+
+def read_frame_store_header(store_path : str) -> Tuple[int, int, int]:
+    with open(store_path, 'rb') as store_file:
+        header = store_file.read(FRAME_STORE_HEADER_SIZE)
+    if len(header) < FRAME_STORE_HEADER_SIZE or header[:4] != FRAME_STORE_MAGIC:
+        raise Exception('invalid frame store ' + store_path)
+    version, frame_count, height, width = struct.unpack('<IIII', header[4:20])
+    if version != FRAME_STORE_VERSION:
+        raise Exception('unsupported frame store version ' + str(version))
+    return frame_count, height, width
+
+
+def write_frame_store(frames_dir : str, vision_frames : Iterator[VisionFrame]) -> int:
+    # Frames are appended behind a blank header, the header is filled in once the count is known
+    store_path = get_frame_store_path(frames_dir)
+    temp_store_path = store_path + '.tmp'
+    frame_count = 0
+    height, width = 0, 0
+
+    with open(temp_store_path, 'wb') as store_file:
+        store_file.write(pack_frame_store_header(0, 0, 0))
+        for vision_frame in vision_frames:
+            height, width = vision_frame.shape[:2]
+            store_file.write(numpy.ascontiguousarray(vision_frame).data)
+            frame_count += 1
+        store_file.seek(0)
+        store_file.write(pack_frame_store_header(frame_count, height, width))
+    os.replace(temp_store_path, store_path)
+    return frame_count
+
+
+def open_frame_store(frames_dir : str) -> numpy.memmap:
+    store_path = get_frame_store_path(frames_dir)
+    store_key = (store_path, os.stat(store_path).st_ino)
+
+    with THREAD_LOCK:
+        if store_key not in FRAME_STORES:
+            frame_count, height, width = read_frame_store_header(store_path)
+            if not frame_count:
+                raise Exception('empty frame store ' + store_path)
+            for stale_store_key in [ key for key in FRAME_STORES if key[0] == store_path ]:
+                del FRAME_STORES[stale_store_key]
+            FRAME_STORES[store_key] = numpy.memmap(store_path, dtype = numpy.uint8, mode = 'r+', offset = FRAME_STORE_HEADER_SIZE, shape = (frame_count, height, width, 3))
+    return FRAME_STORES[store_key]
+
+
+def list_frame_store_names(frames_dir : str) -> List[str]:
+    # Stored frames are named like extracted frames, so manifests and masks line up with the png layout
+    return [ str(index + 1).zfill(4) + FRAME_STORE_EXTENSION for index in range(len(open_frame_store(frames_dir))) ]
+
+
+def split_frame_store_path(frame_path : str) -> Optional[Tuple[str, int]]:
+    frames_dir, frame_name = os.path.split(frame_path)
+    frame_stem, frame_extension = os.path.splitext(frame_name)
+    if frame_extension != FRAME_STORE_EXTENSION or not frame_stem.isdigit():
+        return None
+    return frames_dir, int(frame_stem) - 1
+
+
+def is_frame_store_path(frame_path : str) -> bool:
+    return split_frame_store_path(frame_path) is not None
+
+
+def read_store_frame(frame_path : str) -> Optional[VisionFrame]:
+    frames_dir, frame_index = split_frame_store_path(frame_path)
+    frame_store = open_frame_store(frames_dir)
+    if frame_index < 0 or frame_index >= len(frame_store):
+        return None
+    # A view into the mapped file, nothing is decoded or copied
+    return frame_store[frame_index]
+
+
+def write_store_frame(frame_path : str, vision_frame : VisionFrame) -> bool:
+    frames_dir, frame_index = split_frame_store_path(frame_path)
+    frame_store = open_frame_store(frames_dir)
+    if frame_index < 0 or frame_index >= len(frame_store) or vision_frame.shape != frame_store.shape[1:]:
+        return False
+    store_frame = frame_store[frame_index]
+    # Processors edit a copy and hand it back once the frame succeeded, a view of the same frame is already stored
+    if not numpy.may_share_memory(store_frame, vision_frame):
+        numpy.copyto(store_frame, vision_frame)
+    return True
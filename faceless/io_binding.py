@@ -0,0 +1,96 @@
+from typing import Any, Dict, List, Optional
+import threading
+import weakref
+
+import numpy
+import onnxruntime
+
+THREAD_LOCAL : threading.local = threading.local()
+ONNX_TYPES : Dict[str, Any] =\
+{
+    'tensor(float)': numpy.float32,
+    'tensor(float16)': numpy.float16,
+    'tensor(double)': numpy.float64,
+    'tensor(int64)': numpy.int64,
+    'tensor(int32)': numpy.int32,
+    'tensor(uint8)': numpy.uint8
+}
+
+
+def is_fixed_shape(shape : List[Any]) -> bool:
+    return all(isinstance(dim, int) and dim > 0 for dim in shape)
+
+
+def resolve_input_shape(shape : List[Any]) -> List[Any]:
+    # A symbolic batch dimension is bound as one, batched calls fall back to a regular run
+    return [ 1 if index == 0 and not (isinstance(dim, int) and dim > 0) else dim for index, dim in enumerate(shape) ]
+
+
+def is_fixed_shape_session(session : onnxruntime.InferenceSession) -> bool:
+    return all(is_fixed_shape(resolve_input_shape(session_input.shape)) and session_input.type in ONNX_TYPES for session_input in session.get_inputs())
+
+
+class IOBindingRunner:
+
+    def __init__(self, session : onnxruntime.InferenceSession) -> None:
+        # The runner must not hold the session, it is cached in a weak dictionary keyed by the session
+        self._io_binding = session.io_binding()
+        self._output_names = [ session_output.name for session_output in session.get_outputs() ]
+        self._input_buffers : Dict[str, numpy.ndarray] = {}
+        self._output_buffers : Dict[str, numpy.ndarray] = {}
+
+        for session_input in session.get_inputs():
+            input_buffer = numpy.zeros(resolve_input_shape(session_input.shape), dtype = ONNX_TYPES[session_input.type])
+            self._io_binding.bind_ortvalue_input(session_input.name, onnxruntime.OrtValue.ortvalue_from_numpy(input_buffer))
+            self._input_buffers[session_input.name] = input_buffer
+        for session_output in session.get_outputs():
+            if is_fixed_shape(session_output.shape) and session_output.type in ONNX_TYPES:
+                output_buffer = numpy.empty(session_output.shape, dtype = ONNX_TYPES[session_output.type])
+                self._io_binding.bind_ortvalue_output(session_output.name, onnxruntime.OrtValue.ortvalue_from_numpy(output_buffer))
+                self._output_buffers[session_output.name] = output_buffer
+            else:
+                self._io_binding.bind_output(session_output.name, 'cpu')
+
+    def get_input_buffer(self, name : str) -> numpy.ndarray:
+        return self._input_buffers[name]
+
+    def can_run(self, inputs : Dict[str, Any]) -> bool:
+        return all(numpy.shape(value) == self._input_buffers[name].shape for name, value in inputs.items())
+
+    def run(self, session : onnxruntime.InferenceSession, inputs : Optional[Dict[str, Any]] = None) -> List[numpy.ndarray]:
+        for name, value in (inputs or {}).items():
+            if value is not self._input_buffers[name]:
+                numpy.copyto(self._input_buffers[name], value, casting = 'unsafe')
+        session.run_with_iobinding(self._io_binding)
+
+        if len(self._output_buffers) == len(self._output_names):
+            return [ self._output_buffers[name] for name in self._output_names ]
+        bound_outputs = dict(zip(self._output_names, self._io_binding.get_outputs()))
+        return [ self._output_buffers[name] if name in self._output_buffers else bound_outputs[name].numpy() for name in self._output_names ]
+
+
+def get_io_binding_runner(session : onnxruntime.InferenceSession) -> Optional[IOBindingRunner]:
+    # Buffers are reused between runs, so every worker thread gets its own runner per session
+    if not hasattr(THREAD_LOCAL, 'runners'):
+        THREAD_LOCAL.runners = weakref.WeakKeyDictionary()
+    if session not in THREAD_LOCAL.runners:
+        THREAD_LOCAL.runners[session] = IOBindingRunner(session) if is_fixed_shape_session(session) else None
+    return THREAD_LOCAL.runners[session]
+
+
+def run_session(session : onnxruntime.InferenceSession, inputs : Dict[str, Any]) -> List[numpy.ndarray]:
+    # Outputs of fixed shape sessions are the runner buffers, copy anything kept past the next run
+    io_binding_runner = get_io_binding_runner(session)
+    if io_binding_runner is None or not io_binding_runner.can_run(inputs):
+        return session.run(None, inputs)
+    return io_binding_runner.run(session, inputs)
+
+
+def create_input_buffer(session : onnxruntime.InferenceSession, name : str, shape : List[int], dtype : Any = numpy.float32) -> numpy.ndarray:
+    # Let the pre-processing write straight into the bound input when the shapes match
+    io_binding_runner = get_io_binding_runner(session)
+    if io_binding_runner is not None:
+        input_buffer = io_binding_runner.get_input_buffer(name)
+        if input_buffer.shape == tuple(shape) and input_buffer.dtype == dtype:
+            return input_buffer
+    return numpy.empty(shape, dtype = dtype)
@@ -0,0 +1,35 @@
+from functools import lru_cache
+import hashlib
+import os
+
+MODEL_CACHE_DIR_NAME = '.cache'
+
+
+def get_model_name(model_path : str) -> str:
+    return os.path.splitext(os.path.basename(model_path))[0]
+
+
+def get_model_checksum(model_path : str) -> str:
+    model_stat = os.stat(model_path)
+    return calc_file_checksum(model_path, model_stat.st_size, model_stat.st_mtime_ns)
+
+
+@lru_cache(maxsize = None)
+def calc_file_checksum(file_path : str, file_size : int, file_mtime : int) -> str:
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()[:16]
+
+
+def is_cached_model(model_path : str) -> bool:
+    return os.path.basename(os.path.dirname(model_path)) == MODEL_CACHE_DIR_NAME
+
+
+def get_model_cache_path(model_path : str, variant : str) -> str:
+    # Cached variants live next to the source model and are keyed by its checksum, so replacing the model invalidates them
+    model_cache_dir = os.path.dirname(model_path)
+    if not is_cached_model(model_path):
+        model_cache_dir = os.path.join(model_cache_dir, MODEL_CACHE_DIR_NAME)
+    return os.path.join(model_cache_dir, get_model_name(model_path) + '.' + get_model_checksum(model_path) + '.' + variant + '.onnx')
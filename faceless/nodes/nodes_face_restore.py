@@ -22,6 +22,30 @@ class NodesFaceRestore:
                 "images": ("IMAGE",),
                 "restoration_model": (restoration_models,),
             },
+            "optional": {
+                "face_min_size": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 4096,
+                    "display": "number",
+                }),
+                "medium_model": (["none"] + restoration_models, {
+                    "default": "none",
+                }),
+                "face_medium_size": ("INT", {
+                    "default": 256,
+                    "min": 0,
+                    "max": 4096,
+                    "display": "number",
+                }),
+                "crop_cache_threshold": ("FLOAT", {
+                    "default": 0.0,
+                    "min": 0.0,
+                    "max": 255.0,
+                    "step": 0.5,
+                    "display": "number",
+                }),
+            },
         }
 
     CATEGORY = "faceless"
@@ -30,8 +54,8 @@ class NodesFaceRestore:
     RETURN_NAMES = ("IMAGE",)
     FUNCTION = "restoreFace"
 
-    def restoreFace(self, images, restoration_model):
-        face_restoration = FaceRestoration(restoration_model)
+    def restoreFace(self, images, restoration_model, face_min_size = 0, medium_model = "none", face_medium_size = 256, crop_cache_threshold = 0.0):
+        face_restoration = FaceRestoration(restoration_model, face_min_size = face_min_size, medium_model_name = None if medium_model == "none" else medium_model, face_medium_size = face_medium_size, crop_cache_threshold = crop_cache_threshold)
 
         now = f"{int(time.time())}"
         output_path = os.path.join(folder_paths.get_temp_directory(), "faceless/restored_frames", now)
@@ -4,7 +4,7 @@ import os
 import shutil
 
 from ..filesystem import is_video
-from ..ffmpeg import extract_frames as process_extract_frames
+from ..ffmpeg import extract_frames as process_extract_frames, extract_frame_store
 from ..vision import detect_video_fps, detect_video_resolution
 from ..typing import FacelessVideo
 
@@ -35,10 +35,26 @@ class NodesLoadVideo:
                     "display": "number",
                 }),
             },
+            "optional": {
+                "stream_frames": ("BOOLEAN", {
+                    "default": False,
+                    "label_off": "OFF",
+                    "label_on": "ON",
+                }),
+                "frame_store": (["png", "memmap"], {
+                    "default": "png",
+                }),
+                "extract_processes": ("INT", {
+                    "default": 1,
+                    "min": 1,
+                    "max": 16,
+                    "display": "number",
+                }),
+            },
         }
 
     @classmethod
-    def VALIDATE_INPUTS(cls, video, extract_frames: bool, trim_frame_start: int, trim_frame_end: int):
+    def VALIDATE_INPUTS(cls, video, extract_frames: bool, trim_frame_start: int, trim_frame_end: int, stream_frames: bool = False, frame_store: str = "png", extract_processes: int = 1):
         if trim_frame_start != -1 and trim_frame_end != -1 and trim_frame_start >= trim_frame_end:
             return False
         return True
@@ -48,7 +64,7 @@ class NodesLoadVideo:
     RETURN_NAMES = ("video",)
     FUNCTION = "process"
 
-    def process(self, video, extract_frames, trim_frame_start: int, trim_frame_end: int):
+    def process(self, video, extract_frames, trim_frame_start: int, trim_frame_end: int, stream_frames: bool = False, frame_store: str = "png", extract_processes: int = 1):
         video_path = folder_paths.get_annotated_filepath(video)
         video_name, _ = os.path.splitext(os.path.basename(video_path))
         frames_dir = os.path.join(folder_paths.get_temp_directory(), "faceless", video_name, "frames")
@@ -67,23 +83,34 @@ class NodesLoadVideo:
         else:
             final_trim_frame_end = trim_frame_end
 
+        if stream_frames:
+            # Frames are decoded through a pipe when the video is saved, nothing lands on disk
+            extract_frames = False
         if extract_frames:
             # Remove all cached frames
             if os.path.exists(frames_dir):
                 shutil.rmtree(frames_dir)
             os.makedirs(frames_dir)
 
-            if not process_extract_frames(video_path, frames_dir, video_resolution, video_fps, final_trim_frame_start, final_trim_frame_end):
+            if frame_store == "memmap":
+                if not extract_frame_store(video_path, frames_dir, video_resolution, video_fps, final_trim_frame_start, final_trim_frame_end):
+                    raise Exception("Failed to extract frames")
+            elif not process_extract_frames(video_path, frames_dir, video_resolution, video_fps, final_trim_frame_start, final_trim_frame_end, process_count = extract_processes):
                 raise Exception("Failed to extract frames")
 
         faceless_video: FacelessVideo = {
             "video_path": video_path,
             "extract_frames": extract_frames,
             "frames_dir": frames_dir,
+            "masks_dir": None,
+            "stream_frames": stream_frames,
+            "frame_processors": [],
             "output_path": "",
             "resolution": video_resolution,
             "fps": video_fps,
             "trim_frame_start": final_trim_frame_start,
             "trim_frame_end": final_trim_frame_end,
+            "modified_frames": [],
+            "frames_without_faces": None,
         }
         return (faceless_video,)
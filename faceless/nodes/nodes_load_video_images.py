@@ -1,10 +1,11 @@
 import os
 
-from PIL import Image, ImageOps, ImageSequence
+from PIL import ImageOps, ImageSequence
 import torch
 import numpy as np
 
-from ..filesystem import is_image
+from ..filesystem import list_frame_filenames
+from ..frame_io import prefetch_frames, read_frame_image
 from ..typing import FacelessVideo
 
 class NodesLoadVideoImages:
@@ -27,11 +28,8 @@ class NodesLoadVideoImages:
         frames_path = video["frames_dir"]
 
         images = []
-        for file in sorted(os.listdir(frames_path)):
-            file_path = os.path.join(frames_path, file)
-            if not is_image(file_path):
-                continue
-            img = Image.open(file_path)
+        frame_paths = [os.path.join(frames_path, frame_filename) for frame_filename in list_frame_filenames(frames_path)]
+        for img in prefetch_frames(frame_paths, read_frame_image):
             for i in ImageSequence.Iterator(img):
                 i = ImageOps.exif_transpose(i)
                 if i.mode == 'I':
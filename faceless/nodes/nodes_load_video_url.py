@@ -7,7 +7,7 @@ from urllib.parse import urlparse, quote
 
 import folder_paths
 
-from ..ffmpeg import extract_frames as process_extract_frames
+from ..ffmpeg import extract_frames as process_extract_frames, extract_frame_store
 from ..vision import detect_video_fps, detect_video_resolution
 from ..typing import FacelessVideo
 
@@ -39,10 +39,26 @@ class NodesLoadVideoUrl:
                     "display": "number",
                 }),
             },
+            "optional": {
+                "stream_frames": ("BOOLEAN", {
+                    "default": False,
+                    "label_off": "OFF",
+                    "label_on": "ON",
+                }),
+                "frame_store": (["png", "memmap"], {
+                    "default": "png",
+                }),
+                "extract_processes": ("INT", {
+                    "default": 1,
+                    "min": 1,
+                    "max": 16,
+                    "display": "number",
+                }),
+            },
         }
 
     @classmethod
-    def IS_CHANGED(cls, url: str, extract_frames: bool, trim_frame_start: int, trim_frame_end: int):
+    def IS_CHANGED(cls, url: str, extract_frames: bool, trim_frame_start: int, trim_frame_end: int, stream_frames: bool = False, frame_store: str = "png", extract_processes: int = 1):
         # Cache will be handled internal, always return 
         m = hashlib.sha256()
         m.update(str(time.time()).encode('utf-8'))
@@ -54,7 +70,7 @@ class NodesLoadVideoUrl:
     RETURN_NAMES = ("video",)
     FUNCTION = "load_video_url"
 
-    def load_video_url(self, url: str, extract_frames: bool, trim_frame_start: int, trim_frame_end: int):
+    def load_video_url(self, url: str, extract_frames: bool, trim_frame_start: int, trim_frame_end: int, stream_frames: bool = False, frame_store: str = "png", extract_processes: int = 1):
         hash = hashlib.md5()
         hash.update(url.encode('utf-8'))
         url_id = hash.hexdigest()
@@ -98,24 +114,35 @@ class NodesLoadVideoUrl:
         else:
             final_trim_frame_end = trim_frame_end
 
+        if stream_frames:
+            # Frames are decoded through a pipe when the video is saved, nothing lands on disk
+            extract_frames = False
         if extract_frames:
             # Remove all cached frames
             if os.path.exists(frames_dir):
                 shutil.rmtree(frames_dir)
             os.makedirs(frames_dir)
 
-            if not process_extract_frames(video_filepath, frames_dir, video_resolution, video_fps, final_trim_frame_start, final_trim_frame_end):
+            if frame_store == "memmap":
+                if not extract_frame_store(video_filepath, frames_dir, video_resolution, video_fps, final_trim_frame_start, final_trim_frame_end):
+                    raise Exception("Failed to extract frames")
+            elif not process_extract_frames(video_filepath, frames_dir, video_resolution, video_fps, final_trim_frame_start, final_trim_frame_end, process_count = extract_processes):
                 raise Exception("Failed to extract frames")
 
         faceless_video: FacelessVideo = {
             "video_path": video_filepath,
             "extract_frames": extract_frames,
             "frames_dir": frames_dir,
+            "masks_dir": None,
+            "stream_frames": stream_frames,
+            "frame_processors": [],
             "output_path": "",
             "resolution": video_resolution,
             "fps": video_fps,
             "trim_frame_start": final_trim_frame_start,
             "trim_frame_end": final_trim_frame_end,
+            "modified_frames": [],
+            "frames_without_faces": None,
         }
         return (faceless_video,)
 
@@ -56,10 +56,15 @@ class NodesMergeVideos(NodesSaveVideo):
             "video_path": merged_video_path,
             "extract_frames": True,
             "frames_dir": frames_dir,
+            "masks_dir": None,
+            "stream_frames": False,
+            "frame_processors": [],
             "fps": video_fps,
             "resolution": video_resolution,
             "output_path": "",
             "trim_frame_start": None,
             "trim_frame_end": None,
+            "modified_frames": [],
+            "frames_without_faces": None,
         }
         return (merged_video,)
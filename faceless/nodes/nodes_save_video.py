@@ -5,9 +5,10 @@ import time
 
 import folder_paths
 
-from ..ffmpeg import merge_frames, restore_audio
+from ..ffmpeg import merge_frames, read_video_frames, restore_audio, write_video_frames
 
 from ..typing import FacelessVideo
+from ..video import has_modified_frames, is_streamed_video, process_frame_stream
 
 class NodesSaveVideo:
 
@@ -40,8 +41,13 @@ class NodesSaveVideo:
         if not os.path.exists(os.path.dirname(muted_path)):
             os.makedirs(os.path.dirname(muted_path))
 
+        if is_streamed_video(video):
+            # Decode, process and encode through ffmpeg pipes, frame by frame
+            vision_frames = process_frame_stream(video, read_video_frames(video_path, resolution, fps, trim_frame_start, trim_frame_end))
+            if not write_video_frames(vision_frames, video_path, muted_path, resolution, fps):
+                raise Exception("Failed to encode video")
         # Merge frames
-        if not merge_frames(video_path, frames_dir, muted_path, resolution, fps):
+        elif not merge_frames(video_path, frames_dir, muted_path, resolution, fps, masks_dir = video.get("masks_dir")):
             raise Exception("Failed to merge video")
 
         # Restore audio
@@ -58,12 +64,13 @@ class NodesSaveVideo:
         now = int(time.time())
         output_path = os.path.join(output_dir, f"{now}_" + os.path.basename(video_path))
 
-        if video["extract_frames"]:
+        untouched = not has_modified_frames(video) and video["trim_frame_start"] is None and video["trim_frame_end"] is None
+        if (video["extract_frames"] or is_streamed_video(video)) and not untouched:
             # Merge frames and video
             temp_output_path = self.merge_frames_and_audio(video)
             shutil.move(temp_output_path, output_path)
         else:
-            # Just copy the video if not extract frames
+            # Just copy the video if not extract frames or no frame was modified
             shutil.copy(video_path, output_path)
         video["output_path"] = output_path
         return ()
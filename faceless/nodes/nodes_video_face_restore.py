@@ -3,6 +3,7 @@ import os
 from ..processors.face_restoration import FaceRestoration
 
 from ..filesystem import get_faceless_models
+from ..video import update_video_frames, is_streamed_video, add_frame_processor
 
 class NodesVideoFaceRestore:
     @classmethod
@@ -13,6 +14,33 @@ class NodesVideoFaceRestore:
                 "video": ("FACELESS_VIDEO",),
                 "restoration_model": (restoration_models,),
             },
+            "optional": {
+                "execution_backend": (["thread", "process"], {
+                    "default": "thread",
+                }),
+                "face_min_size": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 4096,
+                    "display": "number",
+                }),
+                "medium_model": (["none"] + restoration_models, {
+                    "default": "none",
+                }),
+                "face_medium_size": ("INT", {
+                    "default": 256,
+                    "min": 0,
+                    "max": 4096,
+                    "display": "number",
+                }),
+                "crop_cache_threshold": ("FLOAT", {
+                    "default": 0.0,
+                    "min": 0.0,
+                    "max": 255.0,
+                    "step": 0.5,
+                    "display": "number",
+                }),
+            },
         }
 
     CATEGORY = "faceless"
@@ -21,8 +49,14 @@ class NodesVideoFaceRestore:
     RETURN_NAMES = ("video",)
     FUNCTION = "restoreVideoFace"
 
-    def restoreVideoFace(self, video, restoration_model):
+    def restoreVideoFace(self, video, restoration_model, execution_backend = "thread", face_min_size = 0, medium_model = "none", face_medium_size = 256, crop_cache_threshold = 0.0):
+        if is_streamed_video(video):
+            # Frames are restored while the video is saved
+            if execution_backend != "thread":
+                print(f"execution backend {execution_backend} is not supported for streamed frames, fallback to thread")
+            face_restoration = FaceRestoration(restoration_model, "thread", face_min_size, None if medium_model == "none" else medium_model, face_medium_size, crop_cache_threshold)
+            return (add_frame_processor(video, face_restoration.create_stream_processor()),)
         frames_dir = video["frames_dir"]
-        face_restoration = FaceRestoration(restoration_model)
-        face_restoration.restore_video(frames_dir)
-        return (video,)
+        face_restoration = FaceRestoration(restoration_model, execution_backend, face_min_size, None if medium_model == "none" else medium_model, face_medium_size, crop_cache_threshold)
+        modified_frames, frames_without_faces = face_restoration.restore_video(frames_dir, video.get("frames_without_faces"))
+        return (update_video_frames(video, modified_frames, frames_without_faces),)
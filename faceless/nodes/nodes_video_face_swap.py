@@ -3,6 +3,7 @@ import os
 from ..processors.face_swapper import FaceSwapper
 from ..filesystem import check_faceless_model_exists, get_faceless_models
 from ..typing import FacelessVideo
+from ..video import update_video_frames, is_streamed_video, add_frame_processor
 
 class NodesVideoFaceSwap:
     @classmethod
@@ -19,6 +20,11 @@ class NodesVideoFaceSwap:
                 "detector_model": (detector_models,),
                 "recognizer_model": (recognizer_models,),
             },
+            "optional": {
+                "execution_backend": (["thread", "process"], {
+                    "default": "thread",
+                }),
+            },
         }
 
     CATEGORY = "faceless"
@@ -28,19 +34,25 @@ class NodesVideoFaceSwap:
     FUNCTION = "swap_video_face"
 
     @classmethod
-    def VALIDATE_INPUTS(cls, source_image, target_video, swapper_model, detector_model, recognizer_model):
+    def VALIDATE_INPUTS(cls, source_image, target_video, swapper_model, detector_model, recognizer_model, execution_backend = "thread"):
         swapper_model_exists = check_faceless_model_exists("face_swapper", swapper_model)
         detector_model_exists = check_faceless_model_exists("face_detector", detector_model)
         recognizer_model_exists = check_faceless_model_exists("face_recognizer", recognizer_model)
         return swapper_model_exists and detector_model_exists and recognizer_model_exists
 
-    def swap_video_face(self, source_image, target_video: FacelessVideo, swapper_model, detector_model, recognizer_model):
+    def swap_video_face(self, source_image, target_video: FacelessVideo, swapper_model, detector_model, recognizer_model, execution_backend = "thread"):
+        if is_streamed_video(target_video):
+            # Frames are swapped while the video is saved
+            if execution_backend != "thread":
+                print(f"execution backend {execution_backend} is not supported for streamed frames, fallback to thread")
+            swapper = FaceSwapper(swapper_model, "thread")
+            return (add_frame_processor(target_video, swapper.create_stream_processor(source_image[0])),)
         if not target_video["extract_frames"]:
             raise Exception("target video must be extracted frames")
         frames_dir = target_video["frames_dir"]
 
-        swapper = FaceSwapper(swapper_model)
+        swapper = FaceSwapper(swapper_model, execution_backend)
 
         # Fetch source image or change process_frames argument.
-        swapper.swap_video(source_image[0], frames_dir)
-        return (target_video,)
+        modified_frames, frames_without_faces = swapper.swap_video(source_image[0], frames_dir)
+        return (update_video_frames(target_video, modified_frames, frames_without_faces),)
@@ -1,8 +1,16 @@
 import os
-from PIL import Image
+import shutil
+from itertools import islice
 
-from ..vision import is_image
+import numpy as np
+
+from ..filesystem import list_frame_filenames
+from ..frame_store import has_frame_store
+from ..frame_io import FrameWriter, prefetch_frames, read_frame_image
 from ..typing import FacelessVideo
+from ..video import update_video_frames, is_streamed_video, add_frame_processor
+from ..processors.background_removal import remove_backgrounds, remove_gated_backgrounds, remove_stream_backgrounds
+from ..frame_gate import FrameGate
 from .nodes_remove_background import NodesRemoveBackground
 
 class NodesVideoRemoveBackground(NodesRemoveBackground):
@@ -13,6 +21,45 @@ class NodesVideoRemoveBackground(NodesRemoveBackground):
             "required": {
                 "video": ("FACELESS_VIDEO",),
             },
+            "optional": {
+                "keep_model_loaded": ("BOOLEAN", {
+                    "default": True,
+                }),
+                "batch_size": ("INT", {
+                    "default": 4,
+                    "min": 1,
+                    "max": 64,
+                    "display": "number",
+                }),
+                "backend": (["torch", "onnx", "onnx_int8"], {
+                    "default": "torch",
+                }),
+                "quality": (["auto", "fast", "balanced", "quality"], {
+                    "default": "quality",
+                }),
+                "mask_upsampler": (["bilinear", "guided"], {
+                    "default": "bilinear",
+                }),
+                "output_mode": (["rgba_frames", "masks"], {
+                    "default": "rgba_frames",
+                }),
+                "skip_threshold": ("FLOAT", {
+                    "default": 0.0,
+                    "min": 0.0,
+                    "max": 255.0,
+                    "step": 0.1,
+                    "display": "number",
+                }),
+                "keyframe_interval": ("INT", {
+                    "default": 12,
+                    "min": 1,
+                    "max": 300,
+                    "display": "number",
+                }),
+                "motion_compensation": ("BOOLEAN", {
+                    "default": False,
+                }),
+            },
         }
 
     CATEGORY = "faceless"
@@ -22,22 +69,70 @@ class NodesVideoRemoveBackground(NodesRemoveBackground):
     FUNCTION = "remove_video_background"
 
     @classmethod
-    def VALIDATE_INPUTS(cls, video):
+    def VALIDATE_INPUTS(cls, video, keep_model_loaded = True, batch_size = 4, backend = "torch", quality = "quality", mask_upsampler = "bilinear", output_mode = "rgba_frames", skip_threshold = 0.0, keyframe_interval = 12, motion_compensation = False):
         return super().VALIDATE_INPUTS(())
 
-    def remove_video_background(self, video: FacelessVideo):
+    def remove_video_background(self, video: FacelessVideo, keep_model_loaded = True, batch_size = 4, backend = "torch", quality = "quality", mask_upsampler = "bilinear", output_mode = "rgba_frames", skip_threshold = 0.0, keyframe_interval = 12, motion_compensation = False):
+        if is_streamed_video(video):
+            return (add_frame_processor(video, self.create_stream_processor(keep_model_loaded, batch_size, backend, quality, mask_upsampler, skip_threshold, keyframe_interval, motion_compensation)),)
         frames_dir = video["frames_dir"]
 
-        self.load_model()
+        frame_paths = [os.path.join(frames_dir, frame_filename) for frame_filename in list_frame_filenames(frames_dir)]
+        if has_frame_store(frames_dir):
+            # Stored frames have no alpha channel, the masks are kept apart
+            output_mode = "masks"
+        # Frames that barely changed since the last keyframe reuse its mask, a zero threshold runs every frame
+        frame_gate = FrameGate(skip_threshold, keyframe_interval, motion_compensation) if skip_threshold > 0 else None
+        if output_mode == "masks":
+            masks_dir = os.path.join(os.path.dirname(os.path.normpath(frames_dir)), "masks")
+            self.remove_frames_background_masks(frame_paths, masks_dir, batch_size, backend, quality, mask_upsampler, frame_gate)
+        else:
+            self.remove_frames_background(frame_paths, batch_size, backend, quality, mask_upsampler, frame_gate)
+            masks_dir = None
+        if frame_gate:
+            frame_gate.report()
+        if not keep_model_loaded:
+            self.unload_model()
+
+        updated_video = update_video_frames(video, None, None)
+        updated_video["masks_dir"] = masks_dir
+        return (updated_video,)
+
+    def create_stream_processor(self, keep_model_loaded, batch_size, backend, quality, mask_upsampler, skip_threshold, keyframe_interval, motion_compensation):
+        # Streamed frames carry no alpha, masks are applied to the frames while the video is saved
+        def remove_frames_background(vision_frames):
+            frame_gate = FrameGate(skip_threshold, keyframe_interval, motion_compensation) if skip_threshold > 0 else None
+            yield from remove_stream_backgrounds(vision_frames, batch_size, quality, backend, mask_upsampler, frame_gate)
+            if frame_gate:
+                frame_gate.report()
+            if not keep_model_loaded:
+                self.unload_model()
+        return remove_frames_background
+
+    def remove_frames_background(self, frame_paths, batch_size, backend, quality, mask_upsampler, frame_gate = None):
+        # Only a few batches of frames are held in memory at once, the next chunk is decoded while this one runs
+        frame_images = prefetch_frames(frame_paths, read_frame_image, batch_size * 4)
+        with FrameWriter() as frame_writer:
+            for index in range(0, len(frame_paths), batch_size * 4):
+                chunk_frame_paths = frame_paths[index:index + batch_size * 4]
+                imgs = list(islice(frame_images, len(chunk_frame_paths)))
+                for frame_path, (new_im, _) in zip(chunk_frame_paths, self.remove_backgrounds(imgs, batch_size, backend, quality, mask_upsampler, frame_gate)):
+                    frame_writer.write_image(frame_path, new_im)
 
-        # TODO Improve batch process performance
-        frame_filenames = sorted(os.listdir(frames_dir))
-        for frame_filename in frame_filenames:
-            file_path = os.path.join(frames_dir, frame_filename)
-            if not is_image(file_path):
-                continue
+    def remove_frames_background_masks(self, frame_paths, masks_dir, batch_size, backend, quality, mask_upsampler, frame_gate = None):
+        # The RGB frames stay untouched, only the single channel masks are encoded and merged with alphamerge later
+        if os.path.exists(masks_dir):
+            shutil.rmtree(masks_dir)
+        os.makedirs(masks_dir)
 
-            img = Image.open(file_path)
-            new_im, _ = self.remove_background(img)
-            new_im.save(file_path)
-        return (video,)
+        vision_frames = prefetch_frames(frame_paths, lambda frame_path: np.array(read_frame_image(frame_path).convert("RGB")), batch_size * 4)
+        with FrameWriter() as frame_writer:
+            for index in range(0, len(frame_paths), batch_size * 4):
+                chunk_frame_paths = frame_paths[index:index + batch_size * 4]
+                chunk_vision_frames = list(islice(vision_frames, len(chunk_frame_paths)))
+                if frame_gate is None:
+                    masks = remove_backgrounds(chunk_vision_frames, batch_size, quality, backend, mask_upsampler)
+                else:
+                    masks = remove_gated_backgrounds(chunk_vision_frames, batch_size, frame_gate, quality, backend, mask_upsampler)
+                for frame_path, mask in zip(chunk_frame_paths, masks):
+                    frame_writer.write(os.path.join(masks_dir, os.path.splitext(os.path.basename(frame_path))[0] + ".png"), mask)
@@ -0,0 +1,146 @@
+from typing import Any, Callable, List, Optional
+from queue import Queue
+import os
+import threading
+
+from .scheduler import FrameScheduler
+from .typing import FramePayload
+
+PIPELINE_SENTINEL = object()
+
+
+def create_frame_payload(frames_dir : str, frame_name : str) -> FramePayload:
+    return {
+        'frame_name': frame_name,
+        'frame_path': os.path.join(frames_dir, frame_name),
+        'vision_frame': None,
+        'faces': [],
+        'modified': False,
+        'face_models': {},
+        'error': None
+    }
+
+
+def guard_stage(process : Callable[[FramePayload], FramePayload]) -> Callable[[FramePayload], FramePayload]:
+    # A failing frame carries its error through the remaining stages instead of stopping the pipeline
+    def run_stage(payload : FramePayload) -> FramePayload:
+        if payload['error'] is None:
+            try:
+                return process(payload)
+            except Exception as exception:
+                payload['error'] = repr(exception)
+        return payload
+    return run_stage
+
+
+class PipelineStage:
+
+    def __init__(self, name : str, process : Callable[[Any], Any], worker_count : int, queue_size : int) -> None:
+        self.name = name
+        self.process = process
+        self.worker_count = max(worker_count, 1)
+        self.queue : Queue[Any] = Queue(maxsize = max(queue_size, 1))
+        self.alive_count = self.worker_count
+
+
+class FramePipeline:
+
+    def __init__(self, max_frames_in_flight : int = 16) -> None:
+        self._stages : List[PipelineStage] = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._error : Optional[BaseException] = None
+        self._in_flight = threading.Semaphore(max(max_frames_in_flight, 1))
+        self._completed_count = 0
+        self._payload_count = 0
+        self._scheduler : Optional[FrameScheduler] = None
+
+    def add_stage(self, name : str, process : Callable[[Any], Any], worker_count : int = 1, queue_size : int = 4) -> 'FramePipeline':
+        self._stages.append(PipelineStage(name, process, worker_count, queue_size))
+        return self
+
+    def run(self, scheduler : FrameScheduler) -> None:
+        if not self._stages:
+            raise Exception("pipeline has no stages")
+        self._scheduler = scheduler
+        self._payload_count = len(scheduler)
+
+        threads = [ threading.Thread(target = self._feed, daemon = True) ]
+        for index, stage in enumerate(self._stages):
+            for worker_index in range(stage.worker_count):
+                worker_name = stage.name + '-' + str(worker_index)
+                threads.append(threading.Thread(target = self._work, args = (index, worker_name), name = 'faceless-' + worker_name, daemon = True))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self._error is not None:
+            raise self._error
+
+    def stop(self, error : Optional[BaseException] = None) -> None:
+        with self._lock:
+            if error is not None and self._error is None:
+                self._error = error
+        if self._scheduler is not None:
+            self._scheduler.cancel()
+        self._stop_event.set()
+
+    def _feed(self) -> None:
+        first_stage = self._stages[0]
+        while not self._stop_event.is_set():
+            # Dispatch on demand, the next batch is only requested once the previous one is queued
+            batch = self._scheduler.next_batch()
+            if not batch:
+                break
+            for payload in batch:
+                if not self._acquire_slot():
+                    break
+                first_stage.queue.put(payload)
+        for _ in range(first_stage.worker_count):
+            first_stage.queue.put(PIPELINE_SENTINEL)
+
+    def _acquire_slot(self) -> bool:
+        # Bound the frames held between the first and the last stage
+        while not self._in_flight.acquire(timeout = 0.1):
+            if self._stop_event.is_set():
+                return False
+        return not self._stop_event.is_set()
+
+    def _work(self, index : int, worker_name : str) -> None:
+        stage = self._stages[index]
+        next_stage = self._stages[index + 1] if index + 1 < len(self._stages) else None
+
+        while True:
+            payload = stage.queue.get()
+            if payload is PIPELINE_SENTINEL:
+                break
+
+            result = None
+            if not self._stop_event.is_set():
+                try:
+                    self._scheduler.check()
+                    with self._scheduler.track(worker_name):
+                        result = stage.process(payload)
+                except BaseException as exception:
+                    self.stop(exception)
+            if result is None or self._stop_event.is_set() or next_stage is None:
+                self._complete()
+                continue
+            next_stage.queue.put(result)
+
+        with self._lock:
+            stage.alive_count -= 1
+            is_last_worker = stage.alive_count == 0
+        if is_last_worker and next_stage is not None:
+            for _ in range(next_stage.worker_count):
+                next_stage.queue.put(PIPELINE_SENTINEL)
+
+    def _complete(self) -> None:
+        self._in_flight.release()
+        if self._stop_event.is_set():
+            return
+        with self._lock:
+            self._completed_count += 1
+            completed_count = self._completed_count
+        print(f"progress: {completed_count}/{self._payload_count}")
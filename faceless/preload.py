@@ -0,0 +1,123 @@
+from typing import Any, Callable, List, Optional, Tuple
+import copy
+import os
+import threading
+import time
+
+import numpy
+
+from .face_masker import get_face_occluder, get_face_parser
+from .filesystem import check_faceless_model_exists
+from .io_binding import run_session
+from .processors import face_analyser, face_restoration, face_swapper
+from .quantization import create_sample_inputs
+from .typing import PreloadStatus
+
+THREAD_LOCK : threading.Lock = threading.Lock()
+PRELOAD_THREAD : Optional[threading.Thread] = None
+PRELOAD_STATUS : PreloadStatus =\
+{
+    'state': 'idle',
+    'models': {}
+}
+
+# Opt-in with FACELESS_PRELOAD=1, swapper and restoration models are listed by file name, for example "inswapper_128.onnx,gfpgan_1.4.onnx"
+preload_enabled : bool = os.environ.get('FACELESS_PRELOAD', '') in [ '1', 'true' ]
+preload_model_names : List[str] = [ model_name.strip() for model_name in os.environ.get('FACELESS_PRELOAD_MODELS', '').split(',') if model_name.strip() ]
+
+
+def start_preload() -> Optional[threading.Thread]:
+    global PRELOAD_THREAD
+
+    with THREAD_LOCK:
+        if preload_enabled and PRELOAD_THREAD is None:
+            PRELOAD_STATUS['state'] = 'loading'
+            PRELOAD_THREAD = threading.Thread(target = preload_models, name = 'faceless-preload', daemon = True)
+            PRELOAD_THREAD.start()
+    return PRELOAD_THREAD
+
+
+def get_preload_status() -> PreloadStatus:
+    with THREAD_LOCK:
+        return copy.deepcopy(PRELOAD_STATUS)
+
+
+def preload_models() -> None:
+    has_failed = False
+
+    for name, load_sessions in get_preload_loaders():
+        if not preload_model(name, load_sessions):
+            has_failed = True
+    with THREAD_LOCK:
+        PRELOAD_STATUS['state'] = 'failed' if has_failed else 'ready'
+    preload_status = get_preload_status()
+    print(f"faceless preload {preload_status['state']}: " + ", ".join(f"{name}={model_status['state']}" for name, model_status in preload_status['models'].items()))
+
+
+def get_preload_loaders() -> List[Tuple[str, Callable[[], List[Any]]]]:
+    preload_loaders : List[Tuple[str, Callable[[], List[Any]]]] =\
+    [
+        ('face_analyser', load_face_analyser_sessions),
+        ('face_occluder', lambda: [ get_face_occluder() ]),
+        ('face_parser', lambda: [ get_face_parser() ])
+    ]
+
+    for model_name in preload_model_names:
+        if check_faceless_model_exists('face_swapper', model_name):
+            preload_loaders.append((model_name, lambda model_name = model_name: [ face_swapper.get_frame_processor(model_name) ]))
+        elif check_faceless_model_exists('face_restoration', model_name):
+            preload_loaders.append((model_name, lambda model_name = model_name: [ face_restoration.get_frame_processor(model_name) ]))
+        else:
+            print(f"cannot preload unknown model {model_name}")
+    return preload_loaders
+
+
+def load_face_analyser_sessions() -> List[Any]:
+    analyser = face_analyser.get_face_analyser()
+    sessions = list(analyser.get('face_detectors').values()) + list(analyser.get('face_landmarkers').values())
+    sessions.append(analyser.get('face_recognizer'))
+    sessions.append(analyser.get('gender_age'))
+    # The yunet detector is an opencv model, only onnxruntime sessions take part in the warm-up
+    return [ session for session in sessions if hasattr(session, 'get_inputs') ]
+
+
+def preload_model(name : str, load_sessions : Callable[[], List[Any]]) -> bool:
+    with THREAD_LOCK:
+        model_status = PRELOAD_STATUS['models'][name] = { 'state': 'loading', 'load_time': None, 'warmup_time': None, 'error': None }
+
+    try:
+        started_at = time.perf_counter()
+        sessions = load_sessions()
+        loaded_at = time.perf_counter()
+        for session in sessions:
+            warmup_session(session)
+        with THREAD_LOCK:
+            model_status['load_time'] = round(loaded_at - started_at, 3)
+            model_status['warmup_time'] = round(time.perf_counter() - loaded_at, 3)
+            model_status['state'] = 'ready'
+        return True
+    except Exception as exception:
+        with THREAD_LOCK:
+            model_status['state'] = 'failed'
+            model_status['error'] = repr(exception)
+        print(f"cannot preload {name}: {exception}")
+        return False
+
+
+def warmup_session(session : Any) -> None:
+    # The first run allocates the arena and picks the kernels, feed blank inputs of the shapes used later
+    # Run through the io binding like inference does, so the bound run is the one that gets warmed
+    warmup_vision_frame = numpy.zeros((640, 640, 3), dtype = numpy.uint8)
+    run_session(session, create_sample_inputs(session, warmup_vision_frame, numpy.random.default_rng(0)))
+
+
+def register_preload_route() -> None:
+    try:
+        from aiohttp import web
+        from server import PromptServer
+    except ImportError:
+        return
+
+    @PromptServer.instance.routes.get('/faceless/preload')
+    async def get_preload(request : Any) -> Any:
+        return web.json_response(get_preload_status())
@@ -0,0 +1,21 @@
+import importlib
+import pickle
+import sys
+import types
+
+# Run by path in spawned workers, stdlib only, the package it belongs to is not importable yet
+PROCESS_BOOTSTRAP_NAME = 'faceless_process_bootstrap'
+
+
+def bootstrap_process_worker(package_name : str, package_dir : str, worker_spec : bytes) -> None:
+    # Register the custom node package under the name of the parent, without running its node registration
+    if package_name not in sys.modules:
+        package = types.ModuleType(package_name)
+        package.__path__ = [ package_dir ]
+        sys.modules[package_name] = package
+    process_pool = importlib.import_module(package_name + '.faceless.process_pool')
+    process_pool.init_process_worker(*pickle.loads(worker_spec))
+
+
+if __name__ == PROCESS_BOOTSTRAP_NAME:
+    bootstrap_process_worker(globals()['package_name'], globals()['package_dir'], globals()['worker_spec'])
@@ -0,0 +1,120 @@
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+import multiprocessing
+import os
+import pickle
+import runpy
+import sys
+import time
+import types
+
+from . import execution
+from .process_bootstrap import PROCESS_BOOTSTRAP_NAME
+from .scheduler import FrameScheduler
+
+PROCESS_FRAME_PROCESSOR : Optional[Callable[[Any], Any]] = None
+PROCESS_WORKER_COUNTS : Optional[Callable[[], Dict[str, int]]] = None
+
+
+def init_process_worker(frame_processor : Callable[[Any], Any], intra_op_thread_count : int, worker_counts : Optional[Callable[[], Dict[str, int]]] = None) -> None:
+    global PROCESS_FRAME_PROCESSOR, PROCESS_WORKER_COUNTS
+
+    # Every worker is a fresh interpreter and loads its own sessions once
+    execution.execution_providers = [ 'CPUExecutionProvider' ]
+    execution.execution_intra_op_thread_count = intra_op_thread_count
+    PROCESS_FRAME_PROCESSOR = frame_processor
+    PROCESS_WORKER_COUNTS = worker_counts
+
+
+def create_process_initargs(frame_processor : Callable[[Any], Any], intra_op_thread_count : int, worker_counts : Optional[Callable[[], Dict[str, int]]] = None) -> Tuple[str, Any, str]:
+    # The processor travels as bytes, it can only be unpickled once the bootstrap made the package importable
+    # Pickled in one go, so the counts are read from the very processor instance the worker runs
+    package_name = __name__.rsplit('.faceless.', 1)[0]
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    bootstrap_globals =\
+    {
+        'package_name': package_name,
+        'package_dir': package_dir,
+        'worker_spec': pickle.dumps((frame_processor, intra_op_thread_count, worker_counts))
+    }
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'process_bootstrap.py'), bootstrap_globals, PROCESS_BOOTSTRAP_NAME
+
+
+def create_process_executor(frame_processor : Callable[[Any], Any], process_count : int, worker_counts : Optional[Callable[[], Dict[str, int]]] = None) -> ProcessPoolExecutor:
+    if 'spawn' not in multiprocessing.get_all_start_methods():
+        raise Exception('process backend is not supported on this platform, use the thread backend')
+    intra_op_thread_count = max((os.cpu_count() or 1) // process_count, 1)
+    # Spawned workers share no locks, threads or device contexts with the server process
+    executor = ProcessPoolExecutor(max_workers = process_count, mp_context = multiprocessing.get_context('spawn'), initializer = runpy.run_path, initargs = create_process_initargs(frame_processor, intra_op_thread_count, worker_counts))
+    with hide_main_module():
+        # Workers are launched on submit, start all of them while the main script is hidden
+        for _ in range(process_count):
+            executor.submit(int)
+    return executor
+
+
+@contextmanager
+def hide_main_module() -> Iterator[None]:
+    # Spawned workers run the main script of the parent again, for ComfyUI that is main.py with torch and every prestartup script
+    main_module = sys.modules['__main__']
+    sys.modules['__main__'] = types.ModuleType('__main__')
+    try:
+        yield
+    finally:
+        sys.modules['__main__'] = main_module
+
+
+def process_payloads(payloads : List[Any]) -> Tuple[str, float, List[Tuple[Any, Any]], Dict[str, int]]:
+    started_at = time.perf_counter()
+    results = [ (payload, PROCESS_FRAME_PROCESSOR(payload)) for payload in payloads ]
+    # Counts are running totals of the worker, the parent keeps the latest ones of every worker
+    worker_counts = PROCESS_WORKER_COUNTS() if PROCESS_WORKER_COUNTS else {}
+    return 'process-' + str(os.getpid()), time.perf_counter() - started_at, results, worker_counts
+
+
+def run_process_pool(scheduler : FrameScheduler, frame_processor : Callable[[Any], Any], process_count : int, on_result : Optional[Callable[[Any, Any], None]] = None, worker_counts : Optional[Callable[[], Dict[str, int]]] = None) -> Dict[str, int]:
+    process_count = max(process_count, 1)
+    executor = create_process_executor(frame_processor, process_count, worker_counts)
+    pending : set[Future[Tuple[str, float, List[Tuple[Any, Any]], Dict[str, int]]]] = set()
+    worker_counts_by_name : Dict[str, Dict[str, int]] = {}
+    completed_count = 0
+    try:
+        while True:
+            scheduler.check()
+            while len(pending) < process_count * 2:
+                batch = scheduler.next_batch()
+                if not batch:
+                    break
+                pending.add(executor.submit(process_payloads, batch))
+            if not pending:
+                break
+            done, pending = wait(pending, timeout = 0.1, return_when = FIRST_COMPLETED)
+            for future in done:
+                worker_name, busy_time, results, latest_counts = future.result()
+                worker_counts_by_name[worker_name] = latest_counts
+                scheduler.record(worker_name, busy_time, len(results))
+                if on_result is not None:
+                    for payload, result in results:
+                        on_result(payload, result)
+                completed_count += len(results)
+                print(f"progress: {completed_count}/{len(scheduler)}")
+    except BrokenProcessPool as exception:
+        scheduler.cancel()
+        executor.shutdown(wait = True, cancel_futures = True)
+        raise Exception('process backend workers failed to start or died, use the thread backend on this host') from exception
+    except BaseException:
+        scheduler.cancel()
+        executor.shutdown(wait = True, cancel_futures = True)
+        raise
+    executor.shutdown(wait = True)
+    return sum_worker_counts(list(worker_counts_by_name.values()))
+
+
+def sum_worker_counts(worker_counts : List[Dict[str, int]]) -> Dict[str, int]:
+    summed_counts : Dict[str, int] = {}
+    for counts in worker_counts:
+        for name, count in counts.items():
+            summed_counts[name] = summed_counts.get(name, 0) + count
+    return summed_counts
@@ -0,0 +1,307 @@
+import os
+import threading
+from itertools import islice
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy
+import torch
+import torch.nn.functional as F
+from torchvision.transforms.functional import normalize
+
+from folder_paths import models_dir
+
+from .briarmbg import BriaRMBG
+from ..execution import create_inference_session
+from ..frame_gate import FrameGate
+from ..model_cache import get_model_cache_path
+from ..quantization import quantize_model
+from ..typing import BackgroundRemovalBackend, BackgroundRemovalQuality, BackgroundRemovalUpsampler
+
+THREAD_LOCK : threading.Lock = threading.Lock()
+# Loaded models are kept for the lifetime of the process, keyed by device
+RMBG_MODELS : Dict[str, BriaRMBG] = {}
+RMBG_BATCH_SIZES : Dict[str, int] = {}
+RMBG_SESSIONS : Dict[str, Any] = {}
+RMBG_RESOLUTIONS : Dict[str, int] =\
+{
+    'fast': 512,
+    'balanced': 768,
+    'quality': 1024
+}
+
+
+def get_rmbg_model_path() -> str:
+    return os.path.join(models_dir, "faceless/rmbg.pth")
+
+
+def get_rmbg_device() -> str:
+    if torch.cuda.is_available():
+        return "cuda"
+    if torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+def get_rmbg_model(device : Optional[str] = None) -> BriaRMBG:
+    device = device or get_rmbg_device()
+
+    with THREAD_LOCK:
+        if device not in RMBG_MODELS:
+            rmbg = BriaRMBG()
+            rmbg.load_state_dict(torch.load(get_rmbg_model_path(), map_location=device))
+            rmbg.to(device)
+            rmbg.eval()
+            rmbg.fuse()
+            if device == "cpu":
+                rmbg.to(memory_format=torch.channels_last)
+            RMBG_MODELS[device] = rmbg
+    return RMBG_MODELS[device]
+
+
+def unload_rmbg_model(device : Optional[str] = None) -> None:
+    with THREAD_LOCK:
+        if device is None:
+            RMBG_MODELS.clear()
+        else:
+            RMBG_MODELS.pop(device, None)
+        RMBG_SESSIONS.clear()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+class BriaRMBGInference(torch.nn.Module):
+
+    def __init__(self, rmbg : BriaRMBG) -> None:
+        super().__init__()
+        self.rmbg = rmbg
+
+    def forward(self, x : torch.Tensor) -> torch.Tensor:
+        return self.rmbg.forward_inference(x)
+
+
+def export_rmbg_model(quantize : bool = False) -> str:
+    model_path = get_rmbg_model_path()
+    onnx_model_path = get_model_cache_path(model_path, 'export')
+
+    with THREAD_LOCK:
+        if not os.path.isfile(onnx_model_path):
+            rmbg = BriaRMBG()
+            rmbg.load_state_dict(torch.load(model_path, map_location="cpu"))
+            rmbg.eval()
+            rmbg.fuse()
+            os.makedirs(os.path.dirname(onnx_model_path), exist_ok=True)
+            temp_model_path = onnx_model_path + '.tmp'
+            with torch.inference_mode():
+                torch.onnx.export(BriaRMBGInference(rmbg), torch.zeros(1, 3, 1024, 1024), temp_model_path, opset_version=17, input_names=['input'], output_names=['mask'], dynamic_axes={ 'input': { 0: 'batch', 2: 'height', 3: 'width' }, 'mask': { 0: 'batch', 2: 'height', 3: 'width' } })
+            os.replace(temp_model_path, onnx_model_path)
+            print(f"exported rmbg to {onnx_model_path}")
+    if quantize:
+        return quantize_model(onnx_model_path) or onnx_model_path
+    return onnx_model_path
+
+
+def get_rmbg_session(backend : BackgroundRemovalBackend) -> Any:
+    model_path = export_rmbg_model(backend == 'onnx_int8')
+
+    with THREAD_LOCK:
+        if model_path not in RMBG_SESSIONS:
+            RMBG_SESSIONS[model_path] = create_inference_session(model_path)
+    return RMBG_SESSIONS[model_path]
+
+
+def get_backend_device(backend : BackgroundRemovalBackend) -> str:
+    # onnxruntime takes numpy inputs, the torch pre and post processing stays on the cpu for it
+    if backend == 'torch':
+        return get_rmbg_device()
+    return "cpu"
+
+
+def preprocess_images(vision_frames : List[numpy.ndarray], model_input_size : List[int], device : str, channels_last : bool = False) -> torch.Tensor:
+    if all(vision_frame.shape == vision_frames[0].shape for vision_frame in vision_frames):
+        # Frames of one size are resized together with a single interpolate
+        images = torch.from_numpy(numpy.stack(vision_frames)).to(device).permute(0, 3, 1, 2).float()
+        images = F.interpolate(images, size=model_input_size, mode='bilinear')
+    else:
+        images = torch.cat([ F.interpolate(torch.from_numpy(vision_frame).to(device).permute(2, 0, 1).unsqueeze(0).float(), size=model_input_size, mode='bilinear') for vision_frame in vision_frames ])
+    images = torch.divide(images, 255.0)
+    images = normalize(images, [0.5, 0.5, 0.5], [1.0, 1.0, 1.0])
+    if channels_last:
+        return images.contiguous(memory_format=torch.channels_last)
+    return images.contiguous()
+
+
+def preprocess_image_tensors(images : torch.Tensor, model_input_size : List[int], channels_last : bool = False) -> torch.Tensor:
+    # Same as preprocess_images for a ComfyUI batch already scaled to 0..1 and moved to the device
+    images = F.interpolate(images, size=model_input_size, mode='bilinear')
+    images = normalize(images, [0.5, 0.5, 0.5], [1.0, 1.0, 1.0])
+    if channels_last:
+        return images.contiguous(memory_format=torch.channels_last)
+    return images.contiguous()
+
+
+def infer_masks(images : torch.Tensor, backend : BackgroundRemovalBackend) -> torch.Tensor:
+    if backend == 'torch':
+        return get_rmbg_model(str(images.device.type)).forward_inference(images)
+    rmbg_session = get_rmbg_session(backend)
+    results = rmbg_session.run(None, { rmbg_session.get_inputs()[0].name: images.numpy() })[0]
+    return torch.from_numpy(results)
+
+
+def get_model_input_size(quality : BackgroundRemovalQuality, vision_frames : List[numpy.ndarray]) -> List[int]:
+    if quality == 'auto':
+        # Pick the smallest tier that still covers the source, larger sources are refined by the upsampler
+        frame_size = max(max(vision_frame.shape[:2]) for vision_frame in vision_frames)
+        quality = 'fast' if frame_size <= 640 else 'balanced' if frame_size <= 1280 else 'quality'
+    model_resolution = RMBG_RESOLUTIONS[quality]
+    return [ model_resolution, model_resolution ]
+
+
+def postprocess_masks(results : torch.Tensor, vision_frames : List[numpy.ndarray], upsampler : BackgroundRemovalUpsampler = 'bilinear') -> List[numpy.ndarray]:
+    if all(vision_frame.shape == vision_frames[0].shape for vision_frame in vision_frames):
+        masks = [ mask for mask in normalize_masks(upsample_masks(results, vision_frames, upsampler)) ]
+    else:
+        masks = [ normalize_masks(upsample_masks(result.unsqueeze(0), [ vision_frame ], upsampler))[0] for result, vision_frame in zip(results, vision_frames) ]
+    return [ mask.squeeze(0).cpu().numpy() for mask in masks ]
+
+
+def upsample_masks(masks : torch.Tensor, vision_frames : List[numpy.ndarray], upsampler : BackgroundRemovalUpsampler) -> torch.Tensor:
+    frame_size = vision_frames[0].shape[:2]
+    if upsampler == 'bilinear':
+        return F.interpolate(masks, size=frame_size, mode='bilinear')
+    guides = torch.from_numpy(numpy.stack(vision_frames)).to(masks.device).float().mean(dim=3, keepdim=True).permute(0, 3, 1, 2) / 255.0
+    return guided_upsample(masks.float(), guides)
+
+
+def upsample_mask_tensors(masks : torch.Tensor, images : torch.Tensor, upsampler : BackgroundRemovalUpsampler) -> torch.Tensor:
+    if upsampler == 'bilinear':
+        return F.interpolate(masks, size=images.shape[2:], mode='bilinear')
+    return guided_upsample(masks.float(), images.mean(dim=1, keepdim=True))
+
+
+def box_filter(x : torch.Tensor, radius : int) -> torch.Tensor:
+    return F.avg_pool2d(x, kernel_size=2 * radius + 1, stride=1, padding=radius, count_include_pad=False)
+
+
+def guided_upsample(masks : torch.Tensor, guides : torch.Tensor, radius : int = 2, eps : float = 1e-3) -> torch.Tensor:
+    # Fast guided filter, the linear coefficients are fitted at mask resolution and applied to the full resolution guide
+    low_guides = F.interpolate(guides, size=masks.shape[2:], mode='bilinear')
+    mean_guides = box_filter(low_guides, radius)
+    mean_masks = box_filter(masks, radius)
+    covariance = box_filter(low_guides * masks, radius) - mean_guides * mean_masks
+    variance = box_filter(low_guides * low_guides, radius) - mean_guides * mean_guides
+    a = covariance / (variance + eps)
+    b = mean_masks - a * mean_guides
+    mean_a = F.interpolate(box_filter(a, radius), size=guides.shape[2:], mode='bilinear')
+    mean_b = F.interpolate(box_filter(b, radius), size=guides.shape[2:], mode='bilinear')
+    return (mean_a * guides + mean_b).clamp(0, 1)
+
+
+def normalize_masks(masks : torch.Tensor) -> torch.Tensor:
+    return (stretch_masks(masks) * 255).to(torch.uint8)
+
+
+def stretch_masks(masks : torch.Tensor) -> torch.Tensor:
+    # Stretch every mask of the batch to its own min and max
+    mask_max = torch.amax(masks, dim=(1, 2, 3), keepdim=True)
+    mask_min = torch.amin(masks, dim=(1, 2, 3), keepdim=True)
+    return (masks - mask_min) / (mask_max - mask_min)
+
+
+def is_out_of_memory(exception : Exception) -> bool:
+    return isinstance(exception, torch.cuda.OutOfMemoryError) or 'out of memory' in str(exception) or 'Failed to allocate memory' in str(exception)
+
+
+def run_rmbg_batches(frame_count : int, batch_size : int, backend : BackgroundRemovalBackend, run_batch : Callable[[int, int], Any]) -> Iterator[Any]:
+    batch_size_key = backend + ':' + get_backend_device(backend)
+    # A batch size that ran out of memory once is not tried again on the same device
+    batch_size = max(min(batch_size, RMBG_BATCH_SIZES.get(batch_size_key, batch_size)), 1)
+    index = 0
+
+    while index < frame_count:
+        try:
+            with torch.inference_mode():
+                results = run_batch(index, min(index + batch_size, frame_count))
+        except Exception as exception:
+            if batch_size == 1 or not is_out_of_memory(exception):
+                raise
+            batch_size = batch_size // 2
+            RMBG_BATCH_SIZES[batch_size_key] = batch_size
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+            print(f"rmbg out of memory, retry with batch size {batch_size}")
+            continue
+        yield from results
+        index += len(results)
+
+
+def remove_backgrounds(vision_frames : List[numpy.ndarray], batch_size : int, quality : BackgroundRemovalQuality = 'quality', backend : BackgroundRemovalBackend = 'torch', upsampler : BackgroundRemovalUpsampler = 'bilinear') -> Iterator[numpy.ndarray]:
+    device = get_backend_device(backend)
+
+    def run_batch(start : int, end : int) -> List[numpy.ndarray]:
+        batch_vision_frames = vision_frames[start:end]
+        model_input_size = get_model_input_size(quality, batch_vision_frames)
+        images = preprocess_images(batch_vision_frames, model_input_size, device, backend == 'torch' and device == "cpu")
+        results = infer_masks(images, backend)
+        return postprocess_masks(results, batch_vision_frames, upsampler)
+
+    return run_rmbg_batches(len(vision_frames), batch_size, backend, run_batch)
+
+
+def remove_image_backgrounds(images : torch.Tensor, batch_size : int, quality : BackgroundRemovalQuality = 'quality', backend : BackgroundRemovalBackend = 'torch', upsampler : BackgroundRemovalUpsampler = 'bilinear') -> Tuple[torch.Tensor, torch.Tensor]:
+    # ComfyUI IMAGE batches go through tensor ops only, no PIL or uint8 round trip
+    device = get_backend_device(backend)
+
+    def run_batch(start : int, end : int) -> torch.Tensor:
+        batch_images = images[start:end, :, :, :3].to(device).permute(0, 3, 1, 2)
+        model_input_size = get_model_input_size(quality, images[start:end])
+        results = infer_masks(preprocess_image_tensors(batch_images, model_input_size, backend == 'torch' and device == "cpu"), backend)
+        return stretch_masks(upsample_mask_tensors(results.to(device).float(), batch_images, upsampler)).squeeze(1)
+
+    # Stacked outside of inference mode, so the outputs are regular tensors for the nodes downstream
+    masks = torch.stack(list(run_rmbg_batches(len(images), batch_size, backend, run_batch))).to(images.device)
+    # Same premultiplied RGBA as pasting the image on a transparent canvas
+    no_bg_images = torch.cat([ images[:, :, :, :3] * masks.unsqueeze(3), masks.unsqueeze(3) ], dim=3)
+    return no_bg_images, masks
+
+
+def remove_gated_backgrounds(vision_frames : List[numpy.ndarray], batch_size : int, frame_gate : FrameGate, quality : BackgroundRemovalQuality = 'quality', backend : BackgroundRemovalBackend = 'torch', upsampler : BackgroundRemovalUpsampler = 'bilinear') -> Iterator[numpy.ndarray]:
+    # Frames are gated in order first, so the keyframes still run batched
+    shifts = [ frame_gate.check(vision_frame) for vision_frame in vision_frames ]
+    key_masks = remove_backgrounds([ vision_frame for vision_frame, shift in zip(vision_frames, shifts) if shift is None ], batch_size, quality, backend, upsampler)
+
+    for shift in shifts:
+        if shift is None:
+            key_mask = next(key_masks)
+            frame_gate.set_key_mask(key_mask)
+            yield key_mask
+        else:
+            yield frame_gate.get_mask(shift)
+
+
+def remove_stream_backgrounds(vision_frames : Iterator[numpy.ndarray], batch_size : int, quality : BackgroundRemovalQuality = 'quality', backend : BackgroundRemovalBackend = 'torch', upsampler : BackgroundRemovalUpsampler = 'bilinear', frame_gate : Optional[FrameGate] = None) -> Iterator[numpy.ndarray]:
+    # Streamed frames are bgr and end up encoded without alpha, so the mask is applied on black like the merged RGBA frames
+    while True:
+        chunk_vision_frames = list(islice(vision_frames, batch_size * 4))
+        if not chunk_vision_frames:
+            break
+        rgb_vision_frames = [ numpy.ascontiguousarray(vision_frame[:, :, ::-1]) for vision_frame in chunk_vision_frames ]
+        if frame_gate is None:
+            masks = remove_backgrounds(rgb_vision_frames, batch_size, quality, backend, upsampler)
+        else:
+            masks = remove_gated_backgrounds(rgb_vision_frames, batch_size, frame_gate, quality, backend, upsampler)
+        for vision_frame, mask in zip(chunk_vision_frames, masks):
+            yield (vision_frame * (mask[:, :, numpy.newaxis] / 255.0)).astype(numpy.uint8)
+
+
+def check_rmbg_parity(vision_frames : List[numpy.ndarray], backend : BackgroundRemovalBackend, quality : BackgroundRemovalQuality = 'quality') -> Dict[str, float]:
+    # Compare the final uint8 masks, that is what the nodes hand out
+    mask_errors = []
+
+    for torch_mask, backend_mask in zip(remove_backgrounds(vision_frames, 1, quality, 'torch'), remove_backgrounds(vision_frames, 1, quality, backend)):
+        mask_errors.append(numpy.abs(torch_mask.astype(numpy.int16) - backend_mask.astype(numpy.int16)))
+    parity_metrics : Dict[str, float] =\
+    {
+        'max_abs_error': float(max(mask_error.max() for mask_error in mask_errors)),
+        'mean_abs_error': float(numpy.mean([ mask_error.mean() for mask_error in mask_errors ]))
+    }
+    return parity_metrics
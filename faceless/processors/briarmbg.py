@@ -1,6 +1,7 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.nn.utils.fusion import fuse_conv_bn_eval
 
 
 class REBNCONV(nn.Module):
@@ -19,6 +20,10 @@ class REBNCONV(nn.Module):
 
         return xout
 
+    def fuse(self):
+        self.conv_s1 = fuse_conv_bn_eval(self.conv_s1, self.bn_s1)
+        self.bn_s1 = nn.Identity()
+
 
 def _upsample_like(src, tar):
     src = F.interpolate(src, size=tar.shape[2:], mode="bilinear")
@@ -341,6 +346,10 @@ class myrebnconv(nn.Module):
     def forward(self, x):
         return self.rl(self.bn(self.conv(x)))
 
+    def fuse(self):
+        self.conv = fuse_conv_bn_eval(self.conv, self.bn)
+        self.bn = nn.Identity()
+
 
 class BriaRMBG(nn.Module):
     def __init__(self, config: dict = {"in_ch": 3, "out_ch": 1}):
@@ -455,3 +464,35 @@ class BriaRMBG(nn.Module):
             F.sigmoid(d5),
             F.sigmoid(d6),
         ], [hx1d, hx2d, hx3d, hx4d, hx5d, hx6]
+
+    def forward_inference(self, x):
+        # Only the d1 side output is used for masks, skip the other side outputs and drop features once consumed
+        hxin = self.conv_in(x)
+
+        hx1 = self.stage1(hxin)
+        hx2 = self.stage2(self.pool12(hx1))
+        hx3 = self.stage3(self.pool23(hx2))
+        hx4 = self.stage4(self.pool34(hx3))
+        hx5 = self.stage5(self.pool45(hx4))
+        hx6 = self.stage6(self.pool56(hx5))
+
+        hx = self.stage5d(torch.cat((_upsample_like(hx6, hx5), hx5), 1))
+        del hx5, hx6
+        hx = self.stage4d(torch.cat((_upsample_like(hx, hx4), hx4), 1))
+        del hx4
+        hx = self.stage3d(torch.cat((_upsample_like(hx, hx3), hx3), 1))
+        del hx3
+        hx = self.stage2d(torch.cat((_upsample_like(hx, hx2), hx2), 1))
+        del hx2
+        hx = self.stage1d(torch.cat((_upsample_like(hx, hx1), hx1), 1))
+        del hx1
+
+        d1 = _upsample_like(self.side1(hx), x)
+        return F.sigmoid(d1)
+
+    def fuse(self):
+        # Fold every batch norm into its convolution, only valid in eval mode
+        for module in list(self.modules()):
+            if isinstance(module, (REBNCONV, myrebnconv)):
+                module.fuse()
+        return self
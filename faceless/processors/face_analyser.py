@@ -3,12 +3,12 @@ from typing import List, Optional, Tuple, Any
 import numpy
 import cv2
 import threading
-import onnxruntime
 import traceback
 
 from ..face_store import get_static_faces, set_static_faces
 from ..face_helper import create_static_anchors, distance_to_bounding_box, distance_to_face_landmark_5, warp_face_by_face_landmark_5, warp_face_by_translation, estimate_matrix_by_face_landmark_5, categorize_age, categorize_gender, apply_nms, convert_face_landmark_68_to_5
-from ..execution import apply_execution_provider_options
+from ..execution import create_inference_session
+from ..io_binding import run_session, create_input_buffer
 from ..vision import unpack_resolution, resize_frame_resolution
 from ..filesystem import resolve_relative_path
 from ..typing import FaceLandmark68, FaceLandmarkSet, FaceScoreSet, FaceRecognizerModel, VisionFrame, Face, FaceDetectorModel, BoundingBox, FaceLandmark5, Score, ModelSet, FaceAnalyserOrder, FaceAnalyserAge, FaceAnalyserGender, Embedding
@@ -97,24 +97,24 @@ def get_face_analyser() -> Any:
     with THREAD_LOCK:
         if FACE_ANALYSER is None:
             if face_detector_model in [ 'many', 'retinaface' ]:
-                face_detectors['retinaface'] = onnxruntime.InferenceSession(MODELS['face_detector_retinaface']['path'], providers = apply_execution_provider_options())
+                face_detectors['retinaface'] = create_inference_session(MODELS['face_detector_retinaface']['path'])
             if face_detector_model in [ 'many', 'scrfd' ]:
-                face_detectors['scrfd'] = onnxruntime.InferenceSession(MODELS['face_detector_scrfd']['path'], providers = apply_execution_provider_options())
+                face_detectors['scrfd'] = create_inference_session(MODELS['face_detector_scrfd']['path'])
             if face_detector_model in [ 'many', 'yoloface' ]:
-                face_detectors['yoloface'] = onnxruntime.InferenceSession(MODELS['face_detector_yoloface']['path'], providers = apply_execution_provider_options())
+                face_detectors['yoloface'] = create_inference_session(MODELS['face_detector_yoloface']['path'])
             if face_detector_model in [ 'yunet' ]:
                 face_detectors['yunet'] = cv2.FaceDetectorYN.create(MODELS['face_detector_yunet']['path'], '', (0, 0))
             if face_recognizer_model == 'arcface_blendswap':
-                face_recognizer = onnxruntime.InferenceSession(MODELS['face_recognizer_arcface_blendswap']['path'], providers = apply_execution_provider_options())
+                face_recognizer = create_inference_session(MODELS['face_recognizer_arcface_blendswap']['path'])
             if face_recognizer_model == 'arcface_inswapper':
-                face_recognizer = onnxruntime.InferenceSession(MODELS['face_recognizer_arcface_inswapper']['path'], providers = apply_execution_provider_options())
+                face_recognizer = create_inference_session(MODELS['face_recognizer_arcface_inswapper']['path'])
             if face_recognizer_model == 'arcface_simswap':
-                face_recognizer = onnxruntime.InferenceSession(MODELS['face_recognizer_arcface_simswap']['path'], providers = apply_execution_provider_options())
+                face_recognizer = create_inference_session(MODELS['face_recognizer_arcface_simswap']['path'])
             if face_recognizer_model == 'arcface_uniface':
-                face_recognizer = onnxruntime.InferenceSession(MODELS['face_recognizer_arcface_uniface']['path'], providers = apply_execution_provider_options())
-            face_landmarkers['68'] = onnxruntime.InferenceSession(MODELS['face_landmarker_68']['path'], providers = apply_execution_provider_options())
-            face_landmarkers['68_5'] = onnxruntime.InferenceSession(MODELS['face_landmarker_68_5']['path'], providers = apply_execution_provider_options())
-            gender_age = onnxruntime.InferenceSession(MODELS['gender_age']['path'], providers = apply_execution_provider_options())
+                face_recognizer = create_inference_session(MODELS['face_recognizer_arcface_uniface']['path'])
+            face_landmarkers['68'] = create_inference_session(MODELS['face_landmarker_68']['path'])
+            face_landmarkers['68_5'] = create_inference_session(MODELS['face_landmarker_68_5']['path'])
+            gender_age = create_inference_session(MODELS['gender_age']['path'])
             FACE_ANALYSER =\
             {
                 'face_detectors': face_detectors,
@@ -124,6 +124,11 @@ def get_face_analyser() -> Any:
             }
     return FACE_ANALYSER
 
+def clear_face_analyser() -> None:
+    global FACE_ANALYSER
+
+    FACE_ANALYSER = None
+
 def detect_with_retinaface(vision_frame : VisionFrame, face_detector_size : str) -> Tuple[List[BoundingBox], List[FaceLandmark5], List[Score]]:
     face_detector = get_face_analyser().get('face_detectors').get('retinaface')
     face_detector_width, face_detector_height = unpack_resolution(face_detector_size)
@@ -139,7 +144,7 @@ def detect_with_retinaface(vision_frame : VisionFrame, face_detector_size : str)
 
     detect_vision_frame = prepare_detect_frame(temp_vision_frame, face_detector_size)
     with THREAD_SEMAPHORE:
-        detections = face_detector.run(None,
+        detections = run_session(face_detector,
         {
             face_detector.get_inputs()[0].name: detect_vision_frame
         })
@@ -181,7 +186,7 @@ def detect_with_scrfd(vision_frame : VisionFrame, face_detector_size : str) -> T
 
     detect_vision_frame = prepare_detect_frame(temp_vision_frame, face_detector_size)
     with THREAD_SEMAPHORE:
-        detections = face_detector.run(None,
+        detections = run_session(face_detector,
         {
             face_detector.get_inputs()[0].name: detect_vision_frame
         })
@@ -220,7 +225,7 @@ def detect_with_yoloface(vision_frame : VisionFrame, face_detector_size : str) -
 
     detect_vision_frame = prepare_detect_frame(temp_vision_frame, face_detector_size)
     with THREAD_SEMAPHORE:
-        detections = face_detector.run(None,
+        detections = run_session(face_detector,
         {
             face_detector.get_inputs()[0].name: detect_vision_frame
         })
@@ -330,14 +335,15 @@ def create_faces(vision_frame : VisionFrame, bounding_box_list : List[BoundingBo
 def calc_embedding(temp_vision_frame : VisionFrame, face_landmark_5 : FaceLandmark5) -> Tuple[Embedding, Embedding]:
     face_recognizer = get_face_analyser().get('face_recognizer')
     crop_vision_frame, _ = warp_face_by_face_landmark_5(temp_vision_frame, face_landmark_5, 'arcface_112_v2', (112, 112))
-    crop_vision_frame = crop_vision_frame / 127.5 - 1
-    crop_vision_frame = crop_vision_frame[:, :, ::-1].transpose(2, 0, 1).astype(numpy.float32)
-    crop_vision_frame = numpy.expand_dims(crop_vision_frame, axis = 0)
-    embedding = face_recognizer.run(None,
+    face_recognizer_input_name = face_recognizer.get_inputs()[0].name
+    prepare_vision_frame = create_input_buffer(face_recognizer, face_recognizer_input_name, [ 1, 3, 112, 112 ])
+    numpy.multiply(crop_vision_frame[:, :, ::-1].transpose(2, 0, 1), 1 / 127.5, out = prepare_vision_frame[0], casting = 'unsafe')
+    prepare_vision_frame -= 1
+    embedding = run_session(face_recognizer,
     {
-        face_recognizer.get_inputs()[0].name: crop_vision_frame
+        face_recognizer_input_name: prepare_vision_frame
     })[0]
-    embedding = embedding.ravel()
+    embedding = embedding.ravel().copy()
     normed_embedding = embedding / numpy.linalg.norm(embedding)
     return embedding, normed_embedding
 
@@ -351,10 +357,12 @@ def detect_face_landmark_68(temp_vision_frame : VisionFrame, bounding_box : Boun
     if numpy.mean(crop_vision_frame[:, :, 0]) < 30:
         crop_vision_frame[:, :, 0] = cv2.createCLAHE(clipLimit = 2).apply(crop_vision_frame[:, :, 0])
     crop_vision_frame = cv2.cvtColor(crop_vision_frame, cv2.COLOR_Lab2RGB)
-    crop_vision_frame = crop_vision_frame.transpose(2, 0, 1).astype(numpy.float32) / 255.0
-    face_landmark_68, face_heatmap = face_landmarker.run(None,
+    face_landmarker_input_name = face_landmarker.get_inputs()[0].name
+    prepare_vision_frame = create_input_buffer(face_landmarker, face_landmarker_input_name, [ 1, 3, 256, 256 ])
+    numpy.multiply(crop_vision_frame.transpose(2, 0, 1), 1 / 255.0, out = prepare_vision_frame[0], casting = 'unsafe')
+    face_landmark_68, face_heatmap = run_session(face_landmarker,
     {
-        face_landmarker.get_inputs()[0].name: [ crop_vision_frame ]
+        face_landmarker_input_name: prepare_vision_frame
     })
     face_landmark_68 = face_landmark_68[:, :, :2][0] / 64
     face_landmark_68 = face_landmark_68.reshape(1, -1, 2) * 256
@@ -369,7 +377,7 @@ def expand_face_landmark_68_from_5(face_landmark_5 : FaceLandmark5) -> FaceLandm
     face_landmarker = get_face_analyser().get('face_landmarkers').get('68_5')
     affine_matrix = estimate_matrix_by_face_landmark_5(face_landmark_5, 'ffhq_512', (1, 1))
     face_landmark_5 = cv2.transform(face_landmark_5.reshape(1, -1, 2), affine_matrix).reshape(-1, 2)
-    face_landmark_68_5 = face_landmarker.run(None,
+    face_landmark_68_5 = run_session(face_landmarker,
     {
         face_landmarker.get_inputs()[0].name: [ face_landmark_5 ]
     })[0][0]
@@ -383,11 +391,12 @@ def detect_gender_age(temp_vision_frame : VisionFrame, bounding_box : BoundingBo
     scale = 64 / numpy.subtract(*bounding_box[::-1]).max()
     translation = 48 - bounding_box.sum(axis = 0) * scale * 0.5
     crop_vision_frame, affine_matrix = warp_face_by_translation(temp_vision_frame, translation, scale, (96, 96))
-    crop_vision_frame = crop_vision_frame[:, :, ::-1].transpose(2, 0, 1).astype(numpy.float32)
-    crop_vision_frame = numpy.expand_dims(crop_vision_frame, axis = 0)
-    prediction = gender_age.run(None,
+    gender_age_input_name = gender_age.get_inputs()[0].name
+    prepare_vision_frame = create_input_buffer(gender_age, gender_age_input_name, [ 1, 3, 96, 96 ])
+    numpy.copyto(prepare_vision_frame[0], crop_vision_frame[:, :, ::-1].transpose(2, 0, 1), casting = 'unsafe')
+    prediction = run_session(gender_age,
     {
-        gender_age.get_inputs()[0].name: crop_vision_frame
+        gender_age_input_name: prepare_vision_frame
     })[0][0]
     gender = int(numpy.argmax(prediction[:2]))
     age = int(numpy.round(prediction[2] * 100))
@@ -1,23 +1,30 @@
 import os
-from queue import Queue
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading
-from typing import List
+from functools import partial
+from typing import Dict, Iterator, List, Optional, Tuple
 
-import cv2
 import numpy
-import onnxruntime
 
 from ..processors.face_analyser import get_many_faces
-from ..execution import apply_execution_provider_options
-from ..face_helper import warp_face_by_face_landmark_5, paste_back
+from ..execution import create_inference_session
+from ..io_binding import run_session, create_input_buffer
+from ..face_helper import warp_face_by_face_landmark_5, blend_back
+from ..crop_cache import CropCache
+from ..crop_batcher import CropBatcher
 from ..face_masker import create_static_box_mask, create_occlusion_mask
-from ..vision import read_image, write_image, tensor_to_vision_frame
-from ..typing import VisionFrame, ModelSet, Any
-from ..filesystem import get_faceless_model_path
+from ..vision import tensor_to_vision_frame
+from ..frame_io import FrameWriter, map_frames, read_frame, write_frame
+from ..typing import VisionFrame, ModelSet, Any, Face, FramePayload, ExecutionBackend, FrameStreamProcessor
+from ..filesystem import get_faceless_model_path, list_frame_filenames
+from ..frame_manifest import FrameManifest, create_processor_key
+from ..pipeline import FramePipeline, create_frame_payload, guard_stage
+from ..scheduler import FrameScheduler
+from ..process_pool import run_process_pool
 
 THREAD_LOCK : threading.Lock = threading.Lock()
 THREAD_SEMAPHORE : threading.Semaphore = threading.Semaphore()
+# Sessions are shared by every restoration instance, keyed by model name
+FRAME_PROCESSORS : Dict[str, Any] = {}
 
 MODELS : ModelSet =\
 {
@@ -77,89 +84,246 @@ MODELS : ModelSet =\
     }
 }
 
+def get_frame_processor(model_name : str) -> Any:
+    with THREAD_LOCK:
+        if model_name not in FRAME_PROCESSORS:
+            model_path = get_faceless_model_path('face_restoration', model_name)
+            FRAME_PROCESSORS[model_name] = create_inference_session(model_path)
+    return FRAME_PROCESSORS[model_name]
+
+def clear_frame_processors() -> None:
+    FRAME_PROCESSORS.clear()
+
 class FaceRestoration:
 
-    def __init__(self, model_name: str) -> None:
+    def __init__(self, model_name: str, execution_backend: ExecutionBackend = 'thread', face_min_size: int = 0, medium_model_name: Optional[str] = None, face_medium_size: int = 0, crop_cache_threshold: float = 0) -> None:
         self._model_name = model_name
+        self._execution_backend = execution_backend
 
-        self._execution_thread_count = 4
-        self._execution_queue_count = 1
+        # Faces smaller than the min size are left as is, faces below the medium size use the lighter medium model
+        self._face_min_size = face_min_size
+        self._medium_model_name = medium_model_name
+        self._face_medium_size = face_medium_size
+        # Reuse the enhanced crop of a face while its aligned crop differs less than the threshold, zero disables it
+        self._crop_cache_threshold = crop_cache_threshold
+        self._crop_cache_max_reuse_count = 4
+        self._crop_cache : Optional[CropCache] = None
 
-        self._frame_processor = None
+        self._reader_thread_count = 2
+        self._analyser_thread_count = 2
+        self._execution_thread_count = 4
+        self._writer_thread_count = 2
+        self._max_frames_in_flight = 16
+        self._execution_batch_size = 1
+        self._max_batch_size = 8
+        # Crops of the frames in flight share session runs, models exported with a fixed batch of one skip it
+        self._crop_batcher = CropBatcher(self._enhance_crop_frames, self._max_batch_size)
+        self._execution_process_count = 4
+        self._frame_attempt_count = 2
 
         self._face_mask_blur = 0.3
         self._face_mask_types = ['box']
         self._face_enhancer_blend = 80
         self._face_enhancer_model = 'gfpgan_1.4'
 
+    def __getstate__(self) -> Dict[str, Any]:
+        # Pickled for process workers, each of them keeps a crop cache of its own
+        state = self.__dict__.copy()
+        state['_crop_cache'] = None
+        state['_crop_batcher'] = None
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._crop_cache = self._create_crop_cache()
+        self._crop_batcher = CropBatcher(self._enhance_crop_frames, self._max_batch_size)
+
     def restore_images(self, images, output_path: str):
-        for (index, image) in enumerate(images):
-            filename = f"{index + 1}".ljust(4, "0") + ".png"
-            output_filepath = os.path.join(output_path, filename)
-
-            target_vision_frame = tensor_to_vision_frame(image)
-            if target_vision_frame is None:
-                raise Exception("invalid target image")
-            output_vision_frame = self._process_frame(target_vision_frame)
-            if output_vision_frame is None:
-                continue
-                # raise Exception("process frame failed")
-            write_image(output_filepath, output_vision_frame)
-
-    def restore_video(self, frames_dir: str):
-        frames_filenames = os.listdir(frames_dir)
-        queue_payloads = sorted(frames_filenames)
-
-        with ThreadPoolExecutor(max_workers = self._execution_thread_count) as executor:
-            futures = []
-            queue : Queue[str] = self._create_queue(queue_payloads)
-            queue_per_future = max(len(queue_payloads) // self._execution_thread_count * self._execution_queue_count, 1)
-            while not queue.empty():
-                future = executor.submit(self._process_frames, frames_dir, self._pick_queue(queue, queue_per_future))
-                futures.append(future)
-            for future_done in as_completed(futures):
-                future_done.result()
-
-    def _create_queue(self, queue_payloads : List[str]) -> Queue[str]:
-        queue : Queue[str] = Queue()
-        for queue_payload in queue_payloads:
-            queue.put(queue_payload)
-        return queue
-
-    def _pick_queue(self, queue : Queue[str], queue_per_future : int) -> List[str]:
-        queues = []
-        for _ in range(queue_per_future):
-            if not queue.empty():
-                queues.append(queue.get())
-        return queues
-
-    def _process_frames(self, target_frames_dir: str, queue_payloads: List[str]):
-        count = len(queue_payloads)
-        for index, frame_filename in enumerate(queue_payloads):
-            print(f"progress: {index + 1}/{count}")
-            frame_filepath = os.path.join(target_frames_dir, frame_filename)
-
-            target_vision_frame = read_image(frame_filepath)
-            if target_vision_frame is None:
-                raise Exception("invalid target image")
-            output_vision_frame = self._process_frame(target_vision_frame)
-            if output_vision_frame is None:
-                continue
-                # raise Exception("process frame failed")
-            write_image(frame_filepath, output_vision_frame)
+        self._crop_cache = self._create_crop_cache()
+        with FrameWriter() as frame_writer:
+            for (index, image) in enumerate(images):
+                filename = f"{index + 1}".ljust(4, "0") + ".png"
+                output_filepath = os.path.join(output_path, filename)
+
+                target_vision_frame = tensor_to_vision_frame(image)
+                if target_vision_frame is None:
+                    raise Exception("invalid target image")
+                output_vision_frame, face_models = self._process_frame(target_vision_frame)
+                print(f"restored {filename}: {self._format_face_models(face_models)}")
+                frame_writer.write(output_filepath, output_vision_frame)
+        if self._crop_cache:
+            self._crop_cache.report()
+
+    def restore_video(self, frames_dir: str, frames_without_faces: Optional[List[str]] = None) -> Tuple[List[str], List[str]]:
+        processor_options = self._get_processor_options()
+        manifest = FrameManifest(frames_dir, create_processor_key('face_restoration', processor_options), processor_options)
+        self._crop_cache = self._create_crop_cache()
+        all_frames_filenames = list_frame_filenames(frames_dir)
+        frames_filenames = manifest.filter_pending(all_frames_filenames)
+        if frames_without_faces:
+            # An earlier analysis found no face, there is nothing to restore
+            skip_frames_filenames = set(frames_without_faces)
+            for frame_filename in frames_filenames:
+                if frame_filename in skip_frames_filenames:
+                    manifest.mark(frame_filename)
+            frames_filenames = [ frame_filename for frame_filename in frames_filenames if frame_filename not in skip_frames_filenames ]
+        try:
+            for _ in range(self._frame_attempt_count):
+                if not frames_filenames:
+                    break
+                self._run_frames(manifest, frames_dir, frames_filenames)
+                frames_filenames = manifest.filter_failed(frames_filenames)
+            manifest.quarantine(frames_filenames)
+        finally:
+            manifest.flush()
+        print(f"restored faces: {self._format_face_models(manifest.count_face_models(all_frames_filenames))}")
+        if self._crop_cache:
+            self._crop_cache.report()
+        self._crop_batcher.report()
+        return manifest.filter_modified(all_frames_filenames), manifest.filter_without_faces(all_frames_filenames)
+
+    def create_stream_processor(self) -> FrameStreamProcessor:
+        def restore_frames(vision_frames: Iterator[VisionFrame]) -> Iterator[VisionFrame]:
+            # A fresh cache per stream, tracks of an earlier run must not leak into this one
+            self._crop_cache = self._create_crop_cache()
+            yield from map_frames(lambda vision_frame: self._process_frame(vision_frame)[0], vision_frames, self._max_frames_in_flight, self._execution_thread_count)
+            if self._crop_cache:
+                self._crop_cache.report()
+        return restore_frames
+
+    def _run_frames(self, manifest: FrameManifest, frames_dir: str, frames_filenames: List[str]):
+        scheduler = FrameScheduler(frames_filenames, self._execution_batch_size)
+        if self._execution_backend == 'process':
+            worker_counts = run_process_pool(scheduler, partial(self._process_frame_file, frames_dir), self._execution_process_count, lambda frame_filename, result: manifest.mark(frame_filename, *result), self._get_worker_counts)
+            if self._crop_cache:
+                self._crop_cache.add_counts(worker_counts)
+            self._crop_batcher.add_counts(worker_counts)
+            scheduler.report()
+            return
+
+        pipeline = FramePipeline(self._max_frames_in_flight)
+        pipeline.add_stage('reader', lambda frame_filename: guard_stage(self._read_frame)(create_frame_payload(frames_dir, frame_filename)), self._reader_thread_count)
+        pipeline.add_stage('analyser', guard_stage(self._analyse_frame), self._analyser_thread_count)
+        pipeline.add_stage('enhancer', guard_stage(self._enhance_frame), self._execution_thread_count)
+        pipeline.add_stage('writer', lambda payload: self._commit_frame(manifest, guard_stage(self._write_frame)(payload)), self._writer_thread_count)
+        pipeline.run(scheduler)
+        scheduler.report()
+
+    def _get_worker_counts(self) -> Dict[str, int]:
+        worker_counts = self._crop_batcher.get_counts()
+        if self._crop_cache:
+            worker_counts.update(self._crop_cache.get_counts())
+        return worker_counts
+
+    def _process_frame_file(self, target_frames_dir: str, frame_filename: str) -> Tuple[Optional[str], bool, int, Dict[str, int]]:
+        payload = create_frame_payload(target_frames_dir, frame_filename)
+        payload = guard_stage(self._read_frame)(payload)
+        payload = guard_stage(self._analyse_frame)(payload)
+        payload = guard_stage(self._enhance_frame)(payload)
+        payload = guard_stage(self._write_frame)(payload)
+        return payload['error'], payload['modified'], len(payload['faces']), payload['face_models']
+
+    def _commit_frame(self, manifest: FrameManifest, payload: FramePayload) -> FramePayload:
+        manifest.mark(payload['frame_name'], payload['error'], payload['modified'], len(payload['faces']), payload['face_models'])
+        return payload
+
+    def _read_frame(self, payload: FramePayload) -> FramePayload:
+        payload['vision_frame'] = read_frame(payload['frame_path'])
+        if payload['vision_frame'] is None:
+            raise Exception("invalid target image")
+        return payload
+
+    def _analyse_frame(self, payload: FramePayload) -> FramePayload:
+        payload['faces'] = get_many_faces(payload['vision_frame'])
+        return payload
+
+    def _enhance_frame(self, payload: FramePayload) -> FramePayload:
+        payload['vision_frame'], payload['face_models'] = self._enhance_faces(payload['vision_frame'], payload['faces'])
+        payload['modified'] = any(face_count for face_model, face_count in payload['face_models'].items() if face_model != 'skipped')
+        return payload
 
-    def _process_frame(self, frame: VisionFrame):
+    def _write_frame(self, payload: FramePayload) -> FramePayload:
+        if payload['modified'] and not write_frame(payload['frame_path'], payload['vision_frame']):
+            raise Exception("cannot write target image")
+        return payload
+
+    def _get_processor_options(self) -> Dict[str, Any]:
+        return {
+            'model': self._model_name,
+            'face_mask_types': self._face_mask_types,
+            'face_mask_blur': self._face_mask_blur,
+            'face_enhancer_blend': self._face_enhancer_blend,
+            'face_min_size': self._face_min_size,
+            'medium_model': self._medium_model_name,
+            'face_medium_size': self._face_medium_size,
+            'crop_cache_threshold': self._crop_cache_threshold,
+            'crop_cache_max_reuse_count': self._crop_cache_max_reuse_count
+        }
+
+    def _process_frame(self, frame: VisionFrame) -> Tuple[VisionFrame, Dict[str, int]]:
         # Support one face and many face mode
         faces = get_many_faces(frame)
-        target_vision_frame = None
+        return self._enhance_faces(frame, faces)
+
+    def _select_face_models(self, faces: List[Face]) -> Dict[str, List[Face]]:
+        face_groups : Dict[str, List[Face]] = {}
+
         for face in faces:
-            target_vision_frame = self._enhance_face(face, frame)
-        return target_vision_frame
+            face_size = numpy.subtract(face.bounding_box[2:], face.bounding_box[:2]).max()
+            if face_size < self._face_min_size:
+                face_groups.setdefault('skipped', []).append(face)
+            elif self._medium_model_name and face_size < self._face_medium_size:
+                face_groups.setdefault(self._medium_model_name, []).append(face)
+            else:
+                face_groups.setdefault(self._model_name, []).append(face)
+        return face_groups
+
+    def _enhance_faces(self, frame: VisionFrame, faces: List[Face]) -> Tuple[VisionFrame, Dict[str, int]]:
+        face_groups = self._select_face_models(faces)
+        face_models = { model_name: len(model_faces) for model_name, model_faces in face_groups.items() }
+        face_groups.pop('skipped', None)
+        if not face_groups:
+            return frame, face_models
+
+        # Crops are all taken from the original frame before any face gets pasted in place
+        paste_list = []
+        for model_name, model_faces in face_groups.items():
+            model_template = self._get_model_options(model_name).get('template')
+            model_size = self._get_model_options(model_name).get('size')
+            enhance_faces = []
+            crop_vision_frames = []
+
+            for face in model_faces:
+                crop_vision_frame, affine_matrix = warp_face_by_face_landmark_5(frame, face.landmarks.get('5/68'), model_template, model_size)
+                crop_mask = self._create_crop_mask(crop_vision_frame)
+                enhanced_vision_frame = self._crop_cache.lookup(model_name, face.bounding_box, crop_vision_frame) if self._crop_cache else None
+                if enhanced_vision_frame is not None:
+                    paste_list.append((enhanced_vision_frame, crop_mask, affine_matrix))
+                    continue
+                enhance_faces.append((face, crop_mask, affine_matrix))
+                crop_vision_frames.append(crop_vision_frame)
+            if not crop_vision_frames:
+                continue
+            if self._has_dynamic_batch(model_name):
+                enhanced_vision_frames = self._crop_batcher.enhance(model_name, crop_vision_frames)
+            else:
+                enhanced_vision_frames = self._enhance_crop_frames(model_name, crop_vision_frames)
+            for (face, crop_mask, affine_matrix), crop_vision_frame, enhanced_vision_frame in zip(enhance_faces, crop_vision_frames, enhanced_vision_frames):
+                if self._crop_cache:
+                    self._crop_cache.store(model_name, face.bounding_box, crop_vision_frame, enhanced_vision_frame)
+                paste_list.append((enhanced_vision_frame, crop_mask, affine_matrix))
+        # Blend into a copy, a frame mapped from the store stays untouched until it is written back as a whole
+        frame = frame.copy()
+        for crop_vision_frame, crop_mask, affine_matrix in paste_list:
+            frame = blend_back(frame, crop_vision_frame, crop_mask, affine_matrix, self._face_enhancer_blend / 100)
+        return frame, face_models
+
+    def _create_crop_cache(self) -> Optional[CropCache]:
+        if self._crop_cache_threshold > 0:
+            return CropCache(self._crop_cache_threshold, self._crop_cache_max_reuse_count)
+        return None
 
-    def _enhance_face(self, face, frame: VisionFrame) -> VisionFrame:
-        model_template = self._get_model_options().get('template')
-        model_size = self._get_model_options().get('size')
-        crop_vision_frame, affine_matrix = warp_face_by_face_landmark_5(frame, face.landmarks.get('5/68'), model_template, model_size)
+    def _create_crop_mask(self, crop_vision_frame : VisionFrame) -> VisionFrame:
         box_mask = create_static_box_mask(crop_vision_frame.shape[:2][::-1], self._face_mask_blur, (0, 0, 0, 0))
         crop_mask_list =\
         [
@@ -169,33 +333,45 @@ class FaceRestoration:
         if 'occlusion' in self._face_mask_types:
             occlusion_mask = create_occlusion_mask(crop_vision_frame)
             crop_mask_list.append(occlusion_mask)
-        crop_vision_frame = self._prepare_crop_frame(crop_vision_frame)
-        crop_vision_frame = self._apply_enhance(crop_vision_frame)
-        crop_vision_frame = self._normalize_crop_frame(crop_vision_frame)
-        crop_mask = numpy.minimum.reduce(crop_mask_list).clip(0, 1)
-        paste_vision_frame = paste_back(frame, crop_vision_frame, crop_mask, affine_matrix)
-        temp_vision_frame = self._blend_frame(frame, paste_vision_frame)
-        return temp_vision_frame
-
-    def _prepare_crop_frame(self, crop_vision_frame : VisionFrame) -> VisionFrame:
-        crop_vision_frame = crop_vision_frame[:, :, ::-1] / 255.0
-        crop_vision_frame = (crop_vision_frame - 0.5) / 0.5
-        crop_vision_frame = numpy.expand_dims(crop_vision_frame.transpose(2, 0, 1), axis = 0).astype(numpy.float32)
-        return crop_vision_frame
+        return numpy.minimum.reduce(crop_mask_list).clip(0, 1)
+
+    def _enhance_crop_frames(self, model_name : str, crop_vision_frames : List[VisionFrame]) -> List[VisionFrame]:
+        # Models exported with a fixed batch of one run the crops one by one
+        batch_size = self._max_batch_size if self._has_dynamic_batch(model_name) else 1
+        enhanced_vision_frames = []
+
+        for index in range(0, len(crop_vision_frames), batch_size):
+            prepare_vision_frame = self._prepare_crop_frames(model_name, crop_vision_frames[index:index + batch_size])
+            # Normalize right away, the outputs may be buffers reused by the next run
+            enhanced_vision_frames.extend(self._normalize_crop_frame(crop_vision_frame) for crop_vision_frame in self._apply_enhance(model_name, prepare_vision_frame))
+        return enhanced_vision_frames
+
+    def _has_dynamic_batch(self, model_name : str) -> bool:
+        for frame_processor_input in get_frame_processor(model_name).get_inputs():
+            if frame_processor_input.name == 'input':
+                return not isinstance(frame_processor_input.shape[0], int) or frame_processor_input.shape[0] < 1
+        return False
 
-    def _apply_enhance(self, crop_vision_frame : VisionFrame) -> VisionFrame:
-        frame_processor = self._get_frame_processor()
+    def _prepare_crop_frames(self, model_name : str, crop_vision_frames : List[VisionFrame]) -> VisionFrame:
+        prepare_vision_frame = create_input_buffer(get_frame_processor(model_name), 'input', [ len(crop_vision_frames), 3 ] + list(crop_vision_frames[0].shape[:2]))
+        for index, crop_vision_frame in enumerate(crop_vision_frames):
+            numpy.multiply(crop_vision_frame[:, :, ::-1].transpose(2, 0, 1), 2 / 255.0, out = prepare_vision_frame[index], casting = 'unsafe')
+        prepare_vision_frame -= 1
+        return prepare_vision_frame
+
+    def _apply_enhance(self, model_name : str, prepare_vision_frame : VisionFrame) -> VisionFrame:
+        frame_processor = get_frame_processor(model_name)
         frame_processor_inputs = {}
 
         for frame_processor_input in frame_processor.get_inputs():
             if frame_processor_input.name == 'input':
-                frame_processor_inputs[frame_processor_input.name] = crop_vision_frame
+                frame_processor_inputs[frame_processor_input.name] = prepare_vision_frame
             if frame_processor_input.name == 'weight':
                 weight = numpy.array([ 1 ]).astype(numpy.double)
                 frame_processor_inputs[frame_processor_input.name] = weight
         with THREAD_SEMAPHORE:
-            crop_vision_frame = frame_processor.run(None, frame_processor_inputs)[0][0]
-        return crop_vision_frame
+            crop_vision_frames = run_session(frame_processor, frame_processor_inputs)[0]
+        return crop_vision_frames
 
     def _normalize_crop_frame(self, crop_vision_frame : VisionFrame) -> VisionFrame:
         crop_vision_frame = numpy.clip(crop_vision_frame, -1, 1)
@@ -205,20 +381,9 @@ class FaceRestoration:
         crop_vision_frame = crop_vision_frame.astype(numpy.uint8)[:, :, ::-1]
         return crop_vision_frame
 
-    def _get_frame_processor(self) -> Any:
-        global FRAME_PROCESSOR
-
-        with THREAD_LOCK:
-            if self._frame_processor is None:
-                model_path = get_faceless_model_path('face_restoration', self._model_name)
-                self._frame_processor = onnxruntime.InferenceSession(model_path, providers = apply_execution_provider_options())
-        return self._frame_processor
-
-    def _blend_frame(self, temp_vision_frame : VisionFrame, paste_vision_frame : VisionFrame) -> VisionFrame:
-        final_face_enhancer_blend = 1 - (self._face_enhancer_blend / 100)
-        temp_vision_frame = cv2.addWeighted(temp_vision_frame, final_face_enhancer_blend, paste_vision_frame, 1 - final_face_enhancer_blend, 0)
-        return temp_vision_frame
+    def _format_face_models(self, face_models: Dict[str, int]) -> str:
+        return ", ".join(f"{model_name}={face_count}" for model_name, face_count in sorted(face_models.items())) or "no faces"
 
-    def _get_model_options(self) -> Any:
-        names = os.path.splitext(self._model_name)
+    def _get_model_options(self, model_name: str) -> Any:
+        names = os.path.splitext(model_name)
         return MODELS.get(names[0])
@@ -1,23 +1,30 @@
 import os
+import hashlib
 import threading
-from typing import Optional, Any, List
-from queue import Queue
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from typing import Optional, Any, Dict, Iterator, List, Tuple
 
 import numpy
 import onnx
 from onnx import numpy_helper
-import onnxruntime
 
 from ..processors.face_analyser import get_average_face, get_many_faces, get_one_face
 from ..face_helper import warp_face_by_face_landmark_5, paste_back
 from ..face_masker import create_static_box_mask, create_occlusion_mask, create_region_mask
-from ..execution import apply_execution_provider_options
-from ..typing import Embedding, Face, VisionFrame, FaceSelectorMode, ModelSet
-from ..vision import read_image, write_image, tensor_to_vision_frame
-from ..filesystem import get_faceless_model_path
+from ..execution import create_inference_session
+from ..io_binding import run_session, create_input_buffer
+from ..typing import Embedding, Face, VisionFrame, FaceSelectorMode, ModelSet, FramePayload, ExecutionBackend, FrameStreamProcessor
+from ..vision import tensor_to_vision_frame
+from ..frame_io import FrameWriter, map_frames, read_frame, write_frame
+from ..filesystem import get_faceless_model_path, list_frame_filenames
+from ..frame_manifest import FrameManifest, create_processor_key
+from ..pipeline import FramePipeline, create_frame_payload, guard_stage
+from ..scheduler import FrameScheduler
+from ..process_pool import run_process_pool
 
 THREAD_LOCK : threading.Lock = threading.Lock()
+# Sessions are shared by every swapper instance, keyed by model name
+FRAME_PROCESSORS : Dict[str, Any] = {}
 
 MODELS : ModelSet =\
 {
@@ -77,17 +84,35 @@ MODELS : ModelSet =\
     }
 }
 
+def get_frame_processor(model_name : str) -> Any:
+    with THREAD_LOCK:
+        if model_name not in FRAME_PROCESSORS:
+            model_path = get_faceless_model_path('face_swapper', model_name)
+            if model_path is None:
+                raise Exception("can not get model path")
+            FRAME_PROCESSORS[model_name] = create_inference_session(model_path)
+    return FRAME_PROCESSORS[model_name]
+
+def clear_frame_processors() -> None:
+    FRAME_PROCESSORS.clear()
+
 class FaceSwapper:
 
-    def __init__(self, model_name: str) -> None:
+    def __init__(self, model_name: str, execution_backend: ExecutionBackend = 'thread') -> None:
         self._model_name = model_name
+        self._execution_backend = execution_backend
 
         self._face_selector_mode: FaceSelectorMode = 'many'
 
-        self._execution_queue_count = 1
+        self._reader_thread_count = 2
+        self._analyser_thread_count = 2
         self._execution_thread_count = 4
+        self._writer_thread_count = 2
+        self._max_frames_in_flight = 16
+        self._execution_batch_size = 1
+        self._execution_process_count = 4
+        self._frame_attempt_count = 2
 
-        self._frame_processor = None
         self._model_initializer = None
 
         self._face_mask_types = ['box']
@@ -106,76 +131,131 @@ class FaceSwapper:
             raise Exception('cannot find source face')
 
         count = len(images)
-        for (index, target_image) in enumerate(images):
-            print(f"progress: {index + 1}/{count}")
-            filename = f"{index + 1}".ljust(4, "0") + ".png"
-            output_filepath = os.path.join(output_path, filename)
-
-            target_vision_frame = tensor_to_vision_frame(target_image)
-            if target_vision_frame is None:
-                raise Exception("invalid target image")
-            output_vision_frame = self._process_frame(source_face, source_frame, target_vision_frame)
-            if output_vision_frame is None:
-                raise Exception("process frame failed")
-            write_image(output_filepath, output_vision_frame)
-
-    def swap_video(self, source_image, target_frames_dir: str):
-        frames_filenames = os.listdir(target_frames_dir)
-        queue_payloads = sorted(frames_filenames)
-        with ThreadPoolExecutor(max_workers = self._execution_thread_count) as executor:
-            futures = []
-            queue : Queue[str] = self._create_queue(queue_payloads)
-            queue_per_future = max(len(queue_payloads) // self._execution_thread_count * self._execution_queue_count, 1)
-            while not queue.empty():
-                future = executor.submit(self._process_frames, source_image, target_frames_dir, self._pick_queue(queue, queue_per_future))
-                futures.append(future)
-            for future_done in as_completed(futures):
-                future_done.result()
-
-    def _process_frames(self, source_image, target_frames_dir: str, queue_payloads: List[str]):
+        # Encoding runs behind the swap of the next image
+        with FrameWriter() as frame_writer:
+            for (index, target_image) in enumerate(images):
+                print(f"progress: {index + 1}/{count}")
+                filename = f"{index + 1}".ljust(4, "0") + ".png"
+                output_filepath = os.path.join(output_path, filename)
+
+                target_vision_frame = tensor_to_vision_frame(target_image)
+                if target_vision_frame is None:
+                    raise Exception("invalid target image")
+                output_vision_frame = self._process_frame(source_face, source_frame, target_vision_frame)
+                if output_vision_frame is None:
+                    raise Exception("process frame failed")
+                frame_writer.write(output_filepath, output_vision_frame)
+
+    def swap_video(self, source_image, target_frames_dir: str) -> Tuple[List[str], List[str]]:
+        source_frame, source_face = self._read_source_face(source_image)
+        processor_options = self._get_processor_options(source_face)
+        manifest = FrameManifest(target_frames_dir, create_processor_key('face_swapper', processor_options), processor_options)
+        all_frames_filenames = list_frame_filenames(target_frames_dir)
+        frames_filenames = manifest.filter_pending(all_frames_filenames)
+        try:
+            for _ in range(self._frame_attempt_count):
+                if not frames_filenames:
+                    break
+                self._run_frames(manifest, source_face, source_frame, target_frames_dir, frames_filenames)
+                frames_filenames = manifest.filter_failed(frames_filenames)
+            manifest.quarantine(frames_filenames)
+        finally:
+            manifest.flush()
+        return manifest.filter_modified(all_frames_filenames), manifest.filter_without_faces(all_frames_filenames)
+
+    def create_stream_processor(self, source_image) -> FrameStreamProcessor:
+        source_frame, source_face = self._read_source_face(source_image)
+
+        def swap_frames(target_vision_frames: Iterator[VisionFrame]) -> Iterator[VisionFrame]:
+            # Streamed frames keep their order, the swaps of the frames in flight run on the execution threads
+            return map_frames(lambda target_vision_frame: self._process_frame(source_face, source_frame, target_vision_frame), target_vision_frames, self._max_frames_in_flight, self._execution_thread_count)
+        return swap_frames
+
+    def _read_source_face(self, source_image) -> Tuple[VisionFrame, Face]:
         source_frame = tensor_to_vision_frame(source_image)
         if source_frame is None:
             raise Exception("cannot read source image")
         source_face = get_average_face([source_frame])
         if source_face is None:
             raise Exception("cannot find source face")
-
-        count = len(queue_payloads)
-        for index, frame_filename in enumerate(queue_payloads):
-            print(f"progress: {index + 1}/{count}")
-            frame_filepath = os.path.join(target_frames_dir, frame_filename)
-
-            target_vision_frame = read_image(frame_filepath)
-            if target_vision_frame is None:
-                raise Exception("invalid target image")
-            output_vision_frame = self._process_frame(source_face, source_frame, target_vision_frame)
-            if output_vision_frame is None:
-                raise Exception("process frame failed")
-            write_image(frame_filepath, output_vision_frame)
+        return source_frame, source_face
+
+    def _run_frames(self, manifest: FrameManifest, source_face: Face, source_vision_frame: VisionFrame, target_frames_dir: str, frames_filenames: List[str]):
+        scheduler = FrameScheduler(frames_filenames, self._execution_batch_size)
+        if self._execution_backend == 'process':
+            run_process_pool(scheduler, partial(self._process_frame_file, source_face, source_vision_frame, target_frames_dir), self._execution_process_count, lambda frame_filename, result: manifest.mark(frame_filename, *result))
+            scheduler.report()
+            return
+
+        pipeline = FramePipeline(self._max_frames_in_flight)
+        pipeline.add_stage('reader', lambda frame_filename: guard_stage(self._read_frame)(create_frame_payload(target_frames_dir, frame_filename)), self._reader_thread_count)
+        pipeline.add_stage('analyser', guard_stage(self._analyse_frame), self._analyser_thread_count)
+        pipeline.add_stage('swapper', guard_stage(lambda payload: self._swap_frame(source_face, source_vision_frame, payload)), self._execution_thread_count)
+        pipeline.add_stage('writer', lambda payload: self._commit_frame(manifest, guard_stage(self._write_frame)(payload)), self._writer_thread_count)
+        pipeline.run(scheduler)
+        scheduler.report()
+
+    def _process_frame_file(self, source_face: Face, source_vision_frame: VisionFrame, target_frames_dir: str, frame_filename: str) -> Tuple[Optional[str], bool, int]:
+        payload = create_frame_payload(target_frames_dir, frame_filename)
+        payload = guard_stage(self._read_frame)(payload)
+        payload = guard_stage(self._analyse_frame)(payload)
+        payload = guard_stage(lambda payload: self._swap_frame(source_face, source_vision_frame, payload))(payload)
+        payload = guard_stage(self._write_frame)(payload)
+        return payload['error'], payload['modified'], len(payload['faces'])
+
+    def _commit_frame(self, manifest: FrameManifest, payload: FramePayload) -> FramePayload:
+        manifest.mark(payload['frame_name'], payload['error'], payload['modified'], len(payload['faces']))
+        return payload
+
+    def _read_frame(self, payload: FramePayload) -> FramePayload:
+        payload['vision_frame'] = read_frame(payload['frame_path'])
+        if payload['vision_frame'] is None:
+            raise Exception("invalid target image")
+        return payload
+
+    def _analyse_frame(self, payload: FramePayload) -> FramePayload:
+        payload['faces'] = self._find_target_faces(payload['vision_frame'])
+        return payload
+
+    def _swap_frame(self, source_face: Face, source_vision_frame: VisionFrame, payload: FramePayload) -> FramePayload:
+        payload['vision_frame'] = self._swap_faces(source_face, source_vision_frame, payload['vision_frame'], payload['faces'])
+        payload['modified'] = len(payload['faces']) > 0
+        return payload
+
+    def _write_frame(self, payload: FramePayload) -> FramePayload:
+        # Frames without a target face are unchanged, skip encoding them again
+        if payload['modified'] and not write_frame(payload['frame_path'], payload['vision_frame']):
+            raise Exception("cannot write target image")
+        return payload
+
+    def _get_processor_options(self, source_face: Face) -> Dict[str, Any]:
+        return {
+            'model': self._model_name,
+            'source_embedding': hashlib.sha1(source_face.embedding.tobytes()).hexdigest(),
+            'face_selector_mode': self._face_selector_mode,
+            'face_mask_types': self._face_mask_types,
+            'face_mask_blur': self._face_mask_blur,
+            'face_mask_padding': self._face_mask_padding,
+            'face_mask_regions': self._face_mask_regions
+        }
 
     def _process_frame(self, source_face: Face, source_vision_frame: VisionFrame, target_vision_frame: VisionFrame) -> Optional[VisionFrame]:
+        target_faces = self._find_target_faces(target_vision_frame)
+        return self._swap_faces(source_face, source_vision_frame, target_vision_frame, target_faces)
+
+    def _find_target_faces(self, target_vision_frame: VisionFrame) -> List[Face]:
         if self._face_selector_mode == 'many':
-            target_faces = get_many_faces(target_vision_frame)
-            for target_face in target_faces:
-                target_vision_frame = self._swap_face(source_face, target_face, source_vision_frame, target_vision_frame)
+            return get_many_faces(target_vision_frame)
         if self._face_selector_mode == 'one':
             target_face = get_one_face(target_vision_frame)
             if target_face:
-                target_vision_frame = self._swap_face(source_face, target_face, source_vision_frame, target_vision_frame)
-        return target_vision_frame
+                return [ target_face ]
+        return []
 
-    def _create_queue(self, queue_payloads: List[str]) -> Queue[str]:
-        queue: Queue[str] = Queue()
-        for queue_payload in queue_payloads:
-            queue.put(queue_payload)
-        return queue
-
-    def _pick_queue(self, queue : Queue[str], queue_per_future : int) -> List[str]:
-        queues = []
-        for _ in range(queue_per_future):
-            if not queue.empty():
-                queues.append(queue.get())
-        return queues
+    def _swap_faces(self, source_face: Face, source_vision_frame: VisionFrame, target_vision_frame: VisionFrame, target_faces: List[Face]) -> VisionFrame:
+        for target_face in target_faces:
+            target_vision_frame = self._swap_face(source_face, target_face, source_vision_frame, target_vision_frame)
+        return target_vision_frame
 
     def _get_model_initializer(self) -> Any:
         with THREAD_LOCK:
@@ -186,13 +266,7 @@ class FaceSwapper:
         return self._model_initializer
 
     def _get_frame_processor(self) -> Any:
-        with THREAD_LOCK:
-            if self._frame_processor is None:
-                model_path = get_faceless_model_path('face_swapper', self._model_name)
-                if model_path is None:
-                    raise Exception("can not get model path")
-                self._frame_processor = onnxruntime.InferenceSession(model_path, providers = apply_execution_provider_options())
-        return self._frame_processor
+        return get_frame_processor(self._model_name)
 
     def _swap_face(self, source_face: Face, target_face: Face, source_vision_frame, target_vision_frame: VisionFrame) -> VisionFrame:
         model_template = self._get_model_options().get('template')
@@ -219,11 +293,11 @@ class FaceSwapper:
     def _prepare_crop_frame(self, crop_vision_frame : VisionFrame) -> VisionFrame:
         model_mean = self._get_model_options().get('mean')
         model_standard_deviation = self._get_model_options().get('standard_deviation')
-        crop_vision_frame = crop_vision_frame[:, :, ::-1] / 255.0
-        crop_vision_frame = (crop_vision_frame - model_mean) / model_standard_deviation
-        crop_vision_frame = crop_vision_frame.transpose(2, 0, 1)
-        crop_vision_frame = numpy.expand_dims(crop_vision_frame, axis = 0).astype(numpy.float32)
-        return crop_vision_frame
+        prepare_vision_frame = create_input_buffer(self._get_frame_processor(), 'target', [ 1, 3 ] + list(crop_vision_frame.shape[:2]))
+        numpy.multiply(crop_vision_frame[:, :, ::-1].transpose(2, 0, 1), 1 / 255.0, out = prepare_vision_frame[0], casting = 'unsafe')
+        prepare_vision_frame[0] -= numpy.array(model_mean, dtype = numpy.float32).reshape(-1, 1, 1)
+        prepare_vision_frame[0] /= numpy.array(model_standard_deviation, dtype = numpy.float32).reshape(-1, 1, 1)
+        return prepare_vision_frame
 
     def _apply_swap(self, source_face : Face, source_vision_frame: VisionFrame, crop_vision_frame : VisionFrame) -> VisionFrame:
         frame_processor = self._get_frame_processor()
@@ -238,7 +312,7 @@ class FaceSwapper:
                     frame_processor_inputs[frame_processor_input.name] = self._prepare_source_embedding(source_face)
             if frame_processor_input.name == 'target':
                 frame_processor_inputs[frame_processor_input.name] = crop_vision_frame
-        crop_vision_frame = frame_processor.run(None, frame_processor_inputs)[0][0]
+        crop_vision_frame = run_session(frame_processor, frame_processor_inputs)[0][0]
         return crop_vision_frame
 
     def _normalize_crop_frame(self, crop_vision_frame : VisionFrame) -> VisionFrame:
@@ -0,0 +1,95 @@
+from typing import Dict, List, Optional
+import os
+import threading
+
+import cv2
+import numpy
+import onnx
+import onnxruntime
+from onnxruntime.quantization import QuantType, quantize_dynamic
+
+from .model_cache import get_model_cache_path, get_model_name
+from .typing import VisionFrame
+
+THREAD_LOCK : threading.Lock = threading.Lock()
+
+
+def is_float16_model(model_path : str) -> bool:
+    model = onnx.load(model_path, load_external_data = False)
+    return any(initializer.data_type == onnx.TensorProto.FLOAT16 for initializer in model.graph.initializer)
+
+
+def quantize_model(model_path : str) -> Optional[str]:
+    quantized_model_path = get_model_cache_path(model_path, 'int8')
+
+    with THREAD_LOCK:
+        if not os.path.isfile(quantized_model_path):
+            if is_float16_model(model_path):
+                print(f"skip quantizing float16 model {get_model_name(model_path)}")
+                return None
+            os.makedirs(os.path.dirname(quantized_model_path), exist_ok = True)
+            temp_model_path = quantized_model_path + '.tmp'
+            quantize_dynamic(model_path, temp_model_path, weight_type = QuantType.QUInt8)
+            os.replace(temp_model_path, quantized_model_path)
+            print(f"quantized {get_model_name(model_path)} to {quantized_model_path}")
+    return quantized_model_path
+
+
+def create_sample_inputs(session : onnxruntime.InferenceSession, sample_vision_frame : VisionFrame, random_generator : numpy.random.Generator) -> Dict[str, numpy.ndarray]:
+    sample_inputs = {}
+
+    for session_input in session.get_inputs():
+        shape = []
+        for index, dim in enumerate(session_input.shape):
+            if isinstance(dim, int) and dim > 0:
+                shape.append(dim)
+            elif len(session_input.shape) == 4 and index > 0:
+                shape.append(640)
+            else:
+                shape.append(1)
+        dtype = numpy.float64 if session_input.type == 'tensor(double)' else numpy.float32
+
+        if session_input.type == 'tensor(double)':
+            sample_inputs[session_input.name] = numpy.ones(shape, dtype = dtype)
+        elif len(shape) == 4 and shape[1] == 3:
+            sample_frame = cv2.resize(sample_vision_frame, (shape[3], shape[2]))[:, :, ::-1]
+            sample_frame = sample_frame.transpose(2, 0, 1)[numpy.newaxis] / 127.5 - 1
+            sample_inputs[session_input.name] = numpy.repeat(sample_frame, shape[0], axis = 0).astype(dtype)
+        elif len(shape) == 4 and shape[3] == 3:
+            sample_frame = cv2.resize(sample_vision_frame, (shape[2], shape[1]))[numpy.newaxis] / 255
+            sample_inputs[session_input.name] = numpy.repeat(sample_frame, shape[0], axis = 0).astype(dtype)
+        else:
+            sample_inputs[session_input.name] = random_generator.random(shape).astype(dtype)
+    return sample_inputs
+
+
+def compare_model_outputs(model_path : str, quantized_model_path : str, sample_vision_frames : List[VisionFrame]) -> Dict[str, float]:
+    model_name = get_model_name(model_path)
+    session = onnxruntime.InferenceSession(model_path, providers = [ 'CPUExecutionProvider' ])
+    quantized_session = onnxruntime.InferenceSession(quantized_model_path, providers = [ 'CPUExecutionProvider' ])
+    random_generator = numpy.random.default_rng(0)
+    cosine_list = []
+    max_error_list = []
+    landmark_error_list = []
+
+    for sample_vision_frame in sample_vision_frames:
+        sample_inputs = create_sample_inputs(session, sample_vision_frame, random_generator)
+        output = session.run(None, sample_inputs)[0].astype(numpy.float64)
+        quantized_output = quantized_session.run(None, sample_inputs)[0].astype(numpy.float64)
+        flat_output = output.ravel()
+        flat_quantized_output = quantized_output.ravel()
+        cosine_list.append(numpy.dot(flat_output, flat_quantized_output) / max(numpy.linalg.norm(flat_output) * numpy.linalg.norm(flat_quantized_output), 1e-12))
+        max_error_list.append(numpy.abs(output - quantized_output).max())
+        if model_name == '2dfan4':
+            # Heatmap coordinates are in 64 px space of the 256 px crop
+            landmark_error = numpy.linalg.norm((output[:, :, :2] - quantized_output[:, :, :2]) / 64 * 256, axis = -1)
+            landmark_error_list.append(landmark_error.mean())
+
+    metrics =\
+    {
+        'cosine': float(numpy.mean(cosine_list)),
+        'max_abs_error': float(numpy.max(max_error_list))
+    }
+    if landmark_error_list:
+        metrics['landmark_error_px'] = float(numpy.mean(landmark_error_list))
+    return metrics
@@ -0,0 +1,65 @@
+from typing import Any, Dict, Iterator, List
+from contextlib import contextmanager
+import threading
+import time
+
+
+class FrameScheduler:
+
+    def __init__(self, payloads : List[Any], batch_size : int = 1) -> None:
+        self._payloads = payloads
+        self._batch_size = max(batch_size, 1)
+        self._cursor = 0
+        self._lock = threading.Lock()
+        self._cancel_event = threading.Event()
+        self._started_at = time.perf_counter()
+        self._busy_times : Dict[str, float] = {}
+        self._dispatch_counts : Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._payloads)
+
+    def next_batch(self) -> List[Any]:
+        with self._lock:
+            if self._cancel_event.is_set():
+                return []
+            batch = self._payloads[self._cursor:self._cursor + self._batch_size]
+            self._cursor += len(batch)
+        return batch
+
+    def cancel(self) -> None:
+        self._cancel_event.set()
+
+    def check(self) -> None:
+        # Imported here, process workers load the processors without bringing up ComfyUI and torch
+        import comfy.model_management
+
+        # Resets the ComfyUI interrupt flag and raises its exception, so the prompt ends as interrupted
+        if self._cancel_event.is_set():
+            raise comfy.model_management.InterruptProcessingException()
+        if comfy.model_management.processing_interrupted():
+            self.cancel()
+            comfy.model_management.throw_exception_if_processing_interrupted()
+
+    @contextmanager
+    def track(self, worker_name : str) -> Iterator[None]:
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(worker_name, time.perf_counter() - started_at, 1)
+
+    def record(self, worker_name : str, busy_time : float, payload_count : int) -> None:
+        with self._lock:
+            self._busy_times[worker_name] = self._busy_times.get(worker_name, 0.0) + busy_time
+            self._dispatch_counts[worker_name] = self._dispatch_counts.get(worker_name, 0) + payload_count
+
+    def get_utilization(self) -> Dict[str, float]:
+        elapsed_time = max(time.perf_counter() - self._started_at, 1e-6)
+        with self._lock:
+            return { worker_name: busy_time / elapsed_time for worker_name, busy_time in self._busy_times.items() }
+
+    def report(self) -> None:
+        utilization = self.get_utilization()
+        for worker_name in sorted(utilization):
+            print(f"worker {worker_name}: {utilization[worker_name] * 100:.1f}% busy, {self._dispatch_counts.get(worker_name, 0)} frames")
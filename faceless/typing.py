@@ -1,4 +1,4 @@
-from typing import Literal, Tuple, TypedDict, Any, Dict, List, Optional
+from typing import Literal, Tuple, TypedDict, Any, Callable, Dict, Iterator, List, Optional
 from collections import namedtuple
 
 import numpy
@@ -36,6 +36,7 @@ Matrix = numpy.ndarray[Any, Any]
 Translation = numpy.ndarray[Any, Any]
 
 FrameFormat = Literal['jpg', 'png', 'bmp']
+FrameStreamProcessor = Callable[[Iterator[VisionFrame]], Iterator[VisionFrame]]
 
 FacelessVideo = TypedDict('FacelessVideo', {
     # raw vidoe file path
@@ -43,12 +44,21 @@ FacelessVideo = TypedDict('FacelessVideo', {
     # frames
     'extract_frames': bool,
     'frames_dir': str,
+    # grayscale alpha of the frames written apart from the untouched RGB frames, None when unused
+    'masks_dir': Optional[str],
+    # streamed videos are decoded through an ffmpeg pipe on save, the processors run lazily in order
+    'stream_frames': bool,
+    'frame_processors': List[FrameStreamProcessor],
     # output vidoe file path
     'output_path': str,
     'resolution': Resolution,
     'fps': Fps,
     'trim_frame_start': Optional[int],
     'trim_frame_end': Optional[int],
+    # frames rewritten since extraction, None when unknown
+    'modified_frames': Optional[List[str]],
+    # frames where face analysis found no face, None when not analysed
+    'frames_without_faces': Optional[List[str]],
 })
 
 Embedding = numpy.ndarray[Any, Any]
@@ -63,6 +73,50 @@ Face = namedtuple('Face',
     'age'
 ])
 
+# Pipeline
+ExecutionBackend = Literal['thread', 'process']
+FramePayload = TypedDict('FramePayload',
+{
+    'frame_name' : str,
+    'frame_path' : str,
+    'vision_frame' : Optional[VisionFrame],
+    'faces' : List[Face],
+    'modified' : bool,
+    'face_models' : Dict[str, int],
+    'error' : Optional[str]
+})
+FrameStatus = Literal['pending', 'done', 'failed', 'quarantined']
+FrameManifestEntry = TypedDict('FrameManifestEntry',
+{
+    'status' : FrameStatus,
+    'attempts' : int,
+    'modified' : bool,
+    'face_count' : int,
+    'face_models' : Dict[str, int],
+    'error' : Optional[str],
+    'generation' : int
+})
+
+# Background Removal
+BackgroundRemovalBackend = Literal['torch', 'onnx', 'onnx_int8']
+BackgroundRemovalQuality = Literal['auto', 'fast', 'balanced', 'quality']
+BackgroundRemovalUpsampler = Literal['bilinear', 'guided']
+
+# Preload
+PreloadState = Literal['idle', 'loading', 'ready', 'failed']
+PreloadModelStatus = TypedDict('PreloadModelStatus',
+{
+    'state' : PreloadState,
+    'load_time' : Optional[float],
+    'warmup_time' : Optional[float],
+    'error' : Optional[str]
+})
+PreloadStatus = TypedDict('PreloadStatus',
+{
+    'state' : PreloadState,
+    'models' : Dict[str, PreloadModelStatus]
+})
+
 # Face Store
 FaceSet = Dict[str, List[Face]]
 FaceStore = TypedDict('FaceStore',
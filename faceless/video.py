@@ -0,0 +1,46 @@
+from typing import Iterator, List, Optional
+
+import comfy.model_management
+
+from .typing import FacelessVideo, FrameStreamProcessor, VisionFrame
+
+
+def update_video_frames(video : FacelessVideo, modified_frames : Optional[List[str]], frames_without_faces : Optional[List[str]]) -> FacelessVideo:
+    updated_video : FacelessVideo = video.copy()
+    known_modified_frames = video.get('modified_frames')
+    if known_modified_frames is None or modified_frames is None:
+        updated_video['modified_frames'] = None
+    else:
+        updated_video['modified_frames'] = sorted(set(known_modified_frames) | set(modified_frames))
+    updated_video['frames_without_faces'] = frames_without_faces
+    return updated_video
+
+
+def has_modified_frames(video : FacelessVideo) -> bool:
+    return video.get('modified_frames') != []
+
+
+def is_streamed_video(video : FacelessVideo) -> bool:
+    return video.get('stream_frames', False)
+
+
+def add_frame_processor(video : FacelessVideo, frame_processor : FrameStreamProcessor) -> FacelessVideo:
+    updated_video : FacelessVideo = video.copy()
+    updated_video['frame_processors'] = video.get('frame_processors', []) + [ frame_processor ]
+    updated_video['modified_frames'] = None
+    updated_video['frames_without_faces'] = None
+    return updated_video
+
+
+def process_frame_stream(video : FacelessVideo, vision_frames : Iterator[VisionFrame]) -> Iterator[VisionFrame]:
+    # Every processor wraps the stream of the previous one, frames flow through all of them one by one
+    for frame_processor in video.get('frame_processors', []):
+        vision_frames = frame_processor(vision_frames)
+    return check_frame_stream(vision_frames)
+
+
+def check_frame_stream(vision_frames : Iterator[VisionFrame]) -> Iterator[VisionFrame]:
+    # Checked once per frame, a cancelled prompt stops pulling frames through the processors
+    for vision_frame in vision_frames:
+        comfy.model_management.throw_exception_if_processing_interrupted()
+        yield vision_frame
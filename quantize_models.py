@@ -0,0 +1,53 @@
+import os
+import sys
+import glob
+import argparse
+
+import cv2
+
+parser = argparse.ArgumentParser(description="Build int8 variants of faceless models and compare them with float32")
+
+parser.add_argument(
+    "--models",
+    nargs="*",
+    help="Model names to quantize, for example 2dfan4 arcface_w600k_r50. All models by default",
+    default=[],
+)
+parser.add_argument(
+    "--skip-check",
+    action="store_true",
+    help="Only build the quantized models, skip the accuracy check",
+    default=False,
+)
+
+args = parser.parse_args()
+
+base_path = os.path.dirname(os.path.realpath(__file__))
+models_dir = os.path.normpath(os.path.join(base_path, "../../models/faceless"))
+sys.path.insert(0, base_path)
+
+from faceless.model_cache import get_model_name
+from faceless.quantization import quantize_model, compare_model_outputs
+
+sample_frames = [cv2.imread(image_path) for image_path in sorted(glob.glob(os.path.join(base_path, "examples/images/*")))]
+sample_frames = [sample_frame for sample_frame in sample_frames if sample_frame is not None]
+
+model_paths = sorted(glob.glob(os.path.join(models_dir, "**/*.onnx"), recursive=True))
+for model_path in model_paths:
+    name = get_model_name(model_path)
+    if args.models and name not in args.models:
+        continue
+
+    print(f"Start quantizing `{name}`")
+    try:
+        quantized_model_path = quantize_model(model_path)
+    except Exception as exception:
+        print(f"Failed to quantize `{name}`: {exception}")
+        continue
+    if quantized_model_path is None or args.skip_check:
+        continue
+
+    metrics = compare_model_outputs(model_path, quantized_model_path, sample_frames)
+    print(f"Checked `{name}`: " + ", ".join(f"{key}={value:.4f}" for key, value in metrics.items()))
+
+print("Enable the int8 models you accept with FACELESS_QUANTIZED_MODELS=<name>,<name> before starting ComfyUI")